@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# File: bench_fixname.py
+#
+# Compare one str.replace() per rename rule against the single pass
+# MultiReplacer, on synthetic source text with a growing number of rules:
+#
+#     python bench/bench_fixname.py [--rules 1,10,50] [--size 5000000]
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from reorgcomp.replace import MultiReplacer
+
+
+def sequential_fixname(renames, s):
+    for (from_, to_) in renames:
+        s = s.replace(from_, to_)
+    return s
+
+
+def sequential_fixnameable(renames, s):
+    for (target, _) in renames:
+        if target in s:
+            return True
+    return False
+
+
+def make_renames(rng, count):
+    renames = []
+    for i in xrange(count):
+        name = "Product%dName%d" % (i, rng.randint(0, 10 ** 6))
+        renames.append((name, name.replace("Product", "Renamed")))
+    return renames
+
+
+def make_text(rng, renames, size, rate):
+    words = []
+    length = 0
+    while length < size:
+        if renames and rng.random() < rate:
+            word = rng.choice(renames)[0]
+        else:
+            word = "identifier%d" % (rng.randint(0, 10 ** 6),)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return (result, time.time() - start)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", default="1,10,50")
+    parser.add_argument("--size", type=int, default=5 * 1024 * 1024)
+    parser.add_argument("--rate", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=1)
+    config = parser.parse_args()
+
+    rng = random.Random(config.seed)
+
+    print "%6s %12s %12s %12s %12s %12s" % (
+        "rules", "replace(s)", "multi(s)", "scan(s)", "mscan(s)", "single_pass")
+
+    for count in [int(S) for S in config.rules.split(',')]:
+
+        renames = make_renames(rng, count)
+        text = make_text(rng, renames, config.size, config.rate)
+        clean = make_text(rng, [], config.size, 0)
+
+        replacer = MultiReplacer(renames)
+
+        (expected, seq_time) = timed(sequential_fixname, renames, text)
+        (actual, multi_time) = timed(replacer.replace, text)
+        assert expected == actual
+
+        # The common case when rewriting a tree: most files have no match
+        (_, scan_time) = timed(sequential_fixnameable, renames, clean)
+        (_, mscan_time) = timed(replacer.search, clean)
+
+        print "%6d %12.3f %12.3f %12.3f %12.3f %12s" % (
+            count, seq_time, multi_time, scan_time, mscan_time, replacer.single_pass)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# File: bench_ratio.py
+#
+# Compare the time taken by the character and line based similarity scorers
+# on synthetic source files of growing size:
+#
+#     python bench/bench_ratio.py [--sizes 1000,10000,100000] [--edits 0.05]
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from reorgcomp.rename import get_char_ratio
+from reorgcomp.rename import get_line_ratio
+
+
+def make_source(rng, size):
+    lines = []
+    length = 0
+    while length < size:
+        line = "    value_%d = compute(%d, \"%s\")\n" % (
+            rng.randint(0, 1000), rng.randint(0, 1000), "x" * rng.randint(0, 30))
+        lines.append(line)
+        length += len(line)
+    return lines
+
+
+def edit_source(rng, lines, rate):
+    edited = list(lines)
+    for _ in xrange(int(len(lines) * rate)):
+        i = rng.randint(0, len(edited) - 1)
+        choice = rng.randint(0, 2)
+        if choice == 0:
+            del edited[i]
+        elif choice == 1:
+            edited.insert(i, "    # inserted comment %d\n" % (i,))
+        else:
+            edited[i] = edited[i].replace("compute", "recompute")
+    return edited
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return (result, time.time() - start)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--edits", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    config = parser.parse_args()
+
+    rng = random.Random(config.seed)
+
+    print "%10s %10s %10s %10s %10s %8s" % (
+        "bytes", "chars", "chars(s)", "lines", "lines(s)", "speedup")
+
+    for size in [int(S) for S in config.sizes.split(',')]:
+
+        lines = make_source(rng, size)
+        data1 = ''.join(lines)
+        data2 = ''.join(edit_source(rng, lines, config.edits))
+
+        (chars, chars_time) = timed(get_char_ratio, data1, data2)
+        (lines_, lines_time) = timed(get_line_ratio, data1, data2)
+
+        print "%10d %10.4f %10.3f %10.4f %10.3f %7.1fx" % (
+            len(data1), chars, chars_time, lines_, lines_time,
+            chars_time / max(lines_time, 1e-6))
+
+
+if __name__ == '__main__':
+    main()
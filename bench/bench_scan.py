@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# File: bench_scan.py
+#
+# Compare walking and hashing a generated tree (see snapshot.py) serially and
+# with the concurrent scanner, on a stand-in for a network filesystem: every
+# listdir, stat and open is delayed by --latency seconds, the way a round
+# trip to the server would delay it.
+#
+#     python bench/bench_scan.py [--files 500] [--latency 0.002] \
+#         [--threads 4,16,64]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import contextlib
+
+import snapshot
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from reorgcomp import scanner
+from reorgcomp import contents
+
+
+def delayed(func, latency):
+    def call(*args, **kwargs):
+        # Like waiting on a socket, sleeping lets the other threads run
+        time.sleep(latency)
+        return func(*args, **kwargs)
+    return call
+
+
+@contextlib.contextmanager
+def latency_injected(latency):
+    """
+    Delay the filesystem calls used by os.walk(), the scanner (without the
+    scandir module, which doesn't go through them) and the content cache.
+    """
+
+    saved = (os.listdir, os.stat, os.lstat, scanner.scandir)
+    os.listdir = delayed(os.listdir, latency)
+    os.stat = delayed(os.stat, latency)
+    os.lstat = delayed(os.lstat, latency)
+    scanner.scandir = None
+    contents.open = delayed(open, latency)
+    try:
+        yield
+    finally:
+        (os.listdir, os.stat, os.lstat, scanner.scandir) = saved
+        del contents.open
+
+
+def scan(walk, hashes, base):
+    cache = contents.ContentCache()
+    entries = list(walk(base))
+    fullpaths = [os.path.join(dirpath, filename)
+                 for (dirpath, _, filenames) in entries for filename in filenames]
+    return (entries, hashes(cache.hash, fullpaths))
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return (result, time.time() - start)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    snapshot.add_arguments(parser)
+    parser.set_defaults(files=500)
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds added to every filesystem call")
+    parser.add_argument("--threads", default="4,16,64")
+    config = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="reorg-bench-")
+
+    try:
+        snapshot.make_snapshots_from(workdir, config)
+        base = os.path.join(workdir, "old")
+
+        print "%10s %10s %10s" % ("threads", "seconds", "speedup")
+
+        with latency_injected(config.latency):
+
+            (expected, serial) = timed(scan, os.walk, map, base)
+            print "%10s %10.3f %10s" % ("serial", serial, "")
+
+            for threads in [int(T) for T in config.threads.split(',')]:
+                concurrent = scanner.Scanner(threads)
+                (result, elapsed) = timed(scan, concurrent.walk, concurrent.map, base)
+                concurrent.close()
+                assert result == expected
+                print "%10d %10.3f %9.1fx" % (threads, elapsed, serial / max(elapsed, 1e-6))
+
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
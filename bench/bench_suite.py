@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# File: bench_suite.py
+#
+# Time the main commands on a generated pair of snapshots (see snapshot.py).
+# Each command runs in its own process so that its peak memory can be
+# measured (that of the main process, --jobs workers aren't counted); the
+# results are printed as one JSON object per command, meant to
+# be appended to a file and tracked over time:
+#
+#     python bench/bench_suite.py [--files 1000] [--jobs 1] \
+#         [--benchmarks rename,findmoves,ratio,duplicates,diff] \
+#         [--output results.jsonl] [--workdir DIR]
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+import snapshot
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.insert(0, REPO)
+
+from reorgcomp import records
+
+
+BENCHMARKS = ["rename", "findmoves", "ratio", "duplicates", "diff"]
+
+
+class Suite(object):
+
+    def __init__(self, workdir, jobs):
+        self.workdir = workdir
+        self.jobs = jobs
+        self.old = os.path.join(workdir, "old")
+        self.new = os.path.join(workdir, "new")
+        self.log = open(os.path.join(workdir, "bench.log"), 'w')
+        self.made = set()
+
+    def path(self, name):
+        return os.path.join(self.workdir, name)
+
+    def run(self, args, stdout = None):
+        """
+        Run reorg with `args`, returns its wall clock time and peak RSS (KB).
+        """
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [REPO] + filter(None, [env.get('PYTHONPATH')]))
+
+        devnull = open(os.devnull, 'w')
+        start = time.time()
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'reorgcomp.rename'] + args,
+            stdout = stdout or devnull, stderr = self.log, env = env)
+        (_, status, usage) = os.wait4(proc.pid, 0)
+        elapsed = time.time() - start
+        proc.returncode = status
+        devnull.close()
+
+        if status != 0:
+            raise RuntimeError("reorg %s failed, see %s" %
+                (' '.join(args), self.log.name,))
+
+        return (elapsed, usage.ru_maxrss)
+
+    def count(self, filename):
+        return sum(1 for _ in records.iter_records(filename))
+
+    def count_files(self, base):
+        return sum(len(filenames) for (_, _, filenames) in os.walk(base))
+
+    def ensure(self, name):
+        # The inputs of a benchmark are made untimed if it didn't run before
+        if name not in self.made:
+            getattr(self, "bench_" + name)()
+
+    def bench_rename(self):
+        target = self.path("rename")
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        shutil.copytree(self.new, target)
+        (elapsed, rss) = self.run(["--cmd", "rename", "--rename_target", target,
+            "--addrename", "module", "component", "--addrename", "pkg", "package",
+            "--jobs", str(self.jobs)])
+        return (elapsed, rss, self.count_files(target))
+
+    def bench_findmoves(self):
+        (elapsed, rss) = self.run(["--cmd", "findmoves", "--basenew", self.new,
+            "--baseold", self.old, "--outfile", self.path("moves.txt"),
+            "--jobs", str(self.jobs)])
+        self.made.add("findmoves")
+        return (elapsed, rss, self.count(self.path("moves.txt")))
+
+    def make_picks(self):
+        self.ensure("findmoves")
+        if "picks" not in self.made:
+            self.run(["--cmd", "top", "--infile", self.path("moves.txt"),
+                "--outfile", self.path("picks.txt")])
+            self.made.add("picks")
+
+    def bench_ratio(self):
+        self.make_picks()
+        (elapsed, rss) = self.run(["--cmd", "ratio", "--infile", self.path("picks.txt"),
+            "--outfile", self.path("ratios.txt")])
+        self.made.add("ratio")
+        return (elapsed, rss, self.count(self.path("picks.txt")))
+
+    def bench_duplicates(self):
+        self.ensure("ratio")
+        (elapsed, rss) = self.run(["--cmd", "duplicates", "--infile", self.path("ratios.txt"),
+            "--outfile", self.path("duplicates.txt")])
+        return (elapsed, rss, self.count(self.path("ratios.txt")))
+
+    def bench_diff(self):
+        self.make_picks()
+        with open(os.devnull, 'w') as devnull:
+            (elapsed, rss) = self.run(["--cmd", "diff", "--infile", self.path("picks.txt")],
+                stdout = devnull)
+        return (elapsed, rss, self.count(self.path("picks.txt")))
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    snapshot.add_arguments(parser)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--benchmarks", default=','.join(BENCHMARKS))
+    parser.add_argument("--output", help="file to append the results to, instead of stdout")
+    parser.add_argument("--workdir", help="directory to generate the snapshots in, kept afterwards")
+    config = parser.parse_args()
+
+    benchmarks = config.benchmarks.split(',')
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark '%s'" % (name,))
+
+    workdir = config.workdir or tempfile.mkdtemp(prefix="reorg-bench-")
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    output = sys.stdout
+    if config.output:
+        output = open(config.output, 'a')
+
+    try:
+        start = time.time()
+        params = snapshot.make_snapshots_from(workdir, config)
+        params['jobs'] = config.jobs
+        sys.stderr.write("snapshot: %d files, %d bytes in %.2fs\n" %
+            (params['files'], params['bytes'], time.time() - start,))
+
+        suite = Suite(workdir, config.jobs)
+
+        for name in benchmarks:
+            (elapsed, rss, items) = getattr(suite, "bench_" + name)()
+            result = {
+                'benchmark': name,
+                'timestamp': int(time.time()),
+                'seconds': round(elapsed, 4),
+                'items': items,
+                'items_per_sec': round(items / max(elapsed, 1e-6), 2),
+                'peak_rss_kb': rss,
+                'params': params,
+                }
+            output.write(json.dumps(result, sort_keys = True) + "\n")
+            output.flush()
+            sys.stderr.write("%-12s %8.3fs %8d items %10.1f items/sec %8d KB\n" %
+                (name, elapsed, items, result['items_per_sec'], rss,))
+
+    finally:
+        if config.output:
+            output.close()
+        if not config.workdir:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# File: snapshot.py
+#
+# Generate a synthetic pair of snapshots of a source tree, OUTDIR/old and
+# OUTDIR/new, where the new one has its files reorganized into other
+# directories and partly edited and renamed:
+#
+#     python bench/snapshot.py OUTDIR [--files 1000] [--depth 3] [--dupes 0.1]
+#         [--edits 0.2] [--renames 0.05] [--size 2000] [--seed 1]
+
+import os
+import random
+import argparse
+
+from bench_ratio import make_source
+from bench_ratio import edit_source
+
+
+# How many files a directory holds on average
+FILES_PER_DIR = 10
+
+# Share of the lines of an edited file that get changed
+EDIT_LINES = 0.05
+
+
+def make_dirs(rng, count, depth, prefix):
+    # A depth of 1 is the top directory alone, no other could ever be added
+    dirs = ['']
+    if depth <= 1:
+        return dirs
+    while len(dirs) < count + 1:
+        parent = rng.choice(dirs)
+        if parent.count(os.sep) + 1 >= depth:
+            continue
+        dirs.append(os.path.join(parent, "%s%d" % (prefix, len(dirs),)))
+    return dirs
+
+
+def place(rng, used, dirs, filename):
+    # Two files with the same name can't be in the same directory
+    for _ in xrange(10):
+        path = os.path.join(rng.choice(dirs), filename)
+        if path not in used:
+            used.add(path)
+            return path
+    (stem, ext) = os.path.splitext(filename)
+    return place(rng, used, dirs, "%s_%d%s" % (stem, len(used), ext,))
+
+
+def write(base, path, lines):
+    fullpath = os.path.join(base, path)
+    dirname = os.path.dirname(fullpath)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(fullpath, 'w') as fp:
+        fp.writelines(lines)
+
+
+def make_snapshots(outdir, files = 1000, depth = 3, dupes = 0.1, edits = 0.2,
+                   renames = 0.05, size = 2000, seed = 1):
+    """
+    Write OUTDIR/old and OUTDIR/new.  `dupes` is the share of files reusing
+    the name of another file, `edits` and `renames` the share of files whose
+    content, respectively name, differs in the new snapshot.  Every file
+    lands in a random directory of a differently organized new tree.  File
+    and directory names contain "module" and "pkg", for the rename
+    benchmark.  Returns a summary of what was generated.
+    """
+
+    rng = random.Random(seed)
+
+    ndirs = max(1, files / FILES_PER_DIR)
+    if depth <= 1:
+        ndirs = 1
+    olddirs = make_dirs(rng, ndirs, depth, "pkg")
+    newdirs = make_dirs(rng, ndirs, depth, "lib_pkg")
+
+    oldused = set()
+    newused = set()
+    names = []
+    total = 0
+
+    for i in xrange(files):
+
+        if names and rng.random() < dupes:
+            filename = rng.choice(names)
+        else:
+            filename = "module_%d.py" % (i,)
+            names.append(filename)
+
+        lines = ["import module_%d\n" % (rng.randint(0, files - 1),)]
+        lines.extend(make_source(rng, rng.randint(size / 2, size * 3 / 2)))
+        total += sum(len(L) for L in lines)
+
+        write(os.path.join(outdir, "old"), place(rng, oldused, olddirs, filename), lines)
+
+        if rng.random() < edits:
+            lines = edit_source(rng, lines, EDIT_LINES)
+        if rng.random() < renames:
+            filename = "renamed_" + filename
+
+        write(os.path.join(outdir, "new"), place(rng, newused, newdirs, filename), lines)
+
+    return {
+        'files': files,
+        'dirs': ndirs,
+        'depth': depth,
+        'dupes': dupes,
+        'edits': edits,
+        'renames': renames,
+        'bytes': total,
+        'seed': seed,
+        }
+
+
+def positive(value):
+    value = int(value)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return value
+
+
+def add_arguments(parser):
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--depth", type=positive, default=3, help="levels of directories, 1 puts all the files at the top")
+    parser.add_argument("--dupes", type=float, default=0.1)
+    parser.add_argument("--edits", type=float, default=0.2)
+    parser.add_argument("--renames", type=float, default=0.05)
+    parser.add_argument("--size", type=int, default=2000, help="average file size in bytes")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def make_snapshots_from(outdir, config):
+    return make_snapshots(outdir, files = config.files, depth = config.depth,
+                          dupes = config.dupes, edits = config.edits,
+                          renames = config.renames, size = config.size,
+                          seed = config.seed)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outdir")
+    add_arguments(parser)
+    config = parser.parse_args()
+
+    summary = make_snapshots_from(config.outdir, config)
+    print "%(files)d files in %(dirs)d directories, %(bytes)d bytes" % summary
+
+
+if __name__ == '__main__':
+    main()
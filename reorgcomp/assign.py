@@ -0,0 +1,165 @@
+# File: assign.py
+
+import heapq
+
+
+# Reduced costs this close to zero are rounding noise from float weights
+_EPSILON = 1e-12
+
+
+def get_components(edges):
+    """
+    Split the edges of a bipartite graph, given as (left, right, weight)
+    tuples, into connected components, each in the order the edges came in.
+    """
+
+    parent = {}
+
+    def find(node):
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            (parent[node], node) = (root, parent[node])
+        return root
+
+    for (left, right, _) in edges:
+        for node in (('l', left), ('r', right)):
+            parent.setdefault(node, node)
+        (a, b) = (find(('l', left)), find(('r', right)))
+        if a != b:
+            parent[b] = a
+
+    components = {}
+    order = []
+    for edge in edges:
+        root = find(('l', edge[0]))
+        if root not in components:
+            components[root] = []
+            order.append(root)
+        components[root].append(edge)
+
+    return [components[root] for root in order]
+
+
+def _match_component(edges):
+    """
+    Maximum weight matching of one connected component by successive
+    shortest augmenting paths (Dijkstra with potentials) on the sparse
+    residual graph: every augmentation adds the path that increases the
+    total weight the most, until no path increases it anymore.
+    """
+
+    lefts = []
+    rights = []
+    lindex = {}
+    rindex = {}
+    for (left, right, _) in edges:
+        if left not in lindex:
+            lindex[left] = len(lefts)
+            lefts.append(left)
+        if right not in rindex:
+            rindex[right] = len(rights)
+            rights.append(right)
+
+    nl = len(lefts)
+    nr = len(rights)
+    sink = nl + nr
+
+    adjacent = [[] for _ in xrange(nl)]
+    weights = {}
+    for (left, right, weight) in edges:
+        (u, v) = (lindex[left], nl + rindex[right])
+        if (u, v) not in weights:
+            adjacent[u].append(v)
+            weights[(u, v)] = weight
+        else:
+            weights[(u, v)] = max(weight, weights[(u, v)])
+
+    match = [None] * (nl + nr)
+
+    # Potentials making every reduced cost non-negative: the edge costs are
+    # the negated weights, so start the right side at its cheapest edge.
+    potential = [0.0] * (nl + nr + 1)
+    for ((u, v), weight) in weights.iteritems():
+        potential[v] = min(potential[v], -weight)
+    potential[sink] = min(potential[nl:sink])
+
+    while True:
+
+        dist = [None] * (nl + nr + 1)
+        prev = [None] * (nl + nr + 1)
+        heap = []
+        for u in xrange(nl):
+            if match[u] is None:
+                dist[u] = -potential[u]
+                heapq.heappush(heap, (dist[u], u))
+
+        done = [False] * (nl + nr + 1)
+
+        while heap:
+            (d, x) = heapq.heappop(heap)
+            if done[x]:
+                continue
+            done[x] = True
+            if x == sink:
+                break
+            if x < nl:
+                steps = [(v, -weights[(x, v)]) for v in adjacent[x] if match[x] != v]
+            elif match[x] is None:
+                steps = [(sink, 0.0)]
+            else:
+                steps = [(match[x], weights[(match[x], x)])]
+            for (y, cost) in steps:
+                nd = d + max(0.0, cost + potential[x] - potential[y])
+                if dist[y] is None or nd < dist[y] - _EPSILON:
+                    dist[y] = nd
+                    prev[y] = x
+                    heapq.heappush(heap, (nd, y))
+
+        if dist[sink] is None:
+            break
+
+        # Only keep augmenting while it increases the total weight
+        if dist[sink] + potential[sink] >= -_EPSILON:
+            break
+
+        limit = dist[sink]
+        for x in xrange(nl + nr + 1):
+            if dist[x] is not None and dist[x] < limit:
+                potential[x] += dist[x]
+            else:
+                potential[x] += limit
+
+        # Flip the path: each left node along it takes the right node after
+        # it, the one it was matched to (its predecessor) moves up the path.
+        v = prev[sink]
+        while v is not None:
+            u = prev[v]
+            following = prev[u]
+            match[u] = v
+            match[v] = u
+            v = following
+
+    matching = {}
+    for u in xrange(nl):
+        if match[u] is not None:
+            matching[lefts[u]] = (rights[match[u] - nl], weights[(u, match[u])])
+    return matching
+
+
+def max_weight_matching(edges):
+    """
+    One-to-one assignment of left to right nodes maximizing the total weight,
+    solved independently for each connected component.  Returns a dict of
+    left -> (right, weight).
+    """
+
+    matching = {}
+    for component in get_components(edges):
+        if len(component) == 1:
+            (left, right, weight) = component[0]
+            matching[left] = (right, weight)
+        else:
+            matching.update(_match_component(component))
+    return matching
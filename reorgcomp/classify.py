@@ -0,0 +1,145 @@
+# File: classify.py
+
+import os
+import re
+
+
+MODE_MAGIC = "magic"
+MODE_FAST = "fast"
+
+MODES = [
+    MODE_MAGIC,
+    MODE_FAST,
+]
+
+SNIFF_SIZE = 8192
+
+TEXT_EXTENSIONS = set([
+    '.txt', '.c', '.h', '.cc', '.cpp', '.cxx', '.hh', '.hpp', '.hxx', '.cs',
+    '.java', '.py', '.pl', '.rb', '.go', '.rs', '.js', '.ts', '.sh', '.bat',
+    '.cmd', '.ps1', '.vb', '.sql', '.html', '.htm', '.css', '.xml', '.xsd',
+    '.xsl', '.json', '.yml', '.yaml', '.ini', '.cfg', '.conf', '.md', '.rst',
+    '.tex', '.csv', '.mk', '.cmake', '.in', '.am', '.def', '.idl', '.rc',
+    '.sln', '.csproj', '.vcproj', '.vcxproj', '.props', '.targets',
+])
+
+BINARY_EXTENSIONS = set([
+    '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.ico', '.tif', '.tiff', '.pdf',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.tar', '.jar', '.war',
+    '.class', '.o', '.obj', '.a', '.so', '.dll', '.exe', '.lib', '.pdb',
+    '.pyc', '.pyo', '.mp3', '.mp4', '.avi', '.wav', '.ttf', '.otf', '.woff',
+])
+
+# Control characters other than the ones that show up in ordinary text
+# files (backspace, tab, newline, form feed, carriage return and escape)
+_BINARY_CONTROLS = re.compile('[\x01-\x07\x0b\x0e-\x1a\x1c-\x1f]')
+
+
+def is_text_mime(mimetype):
+    return ('text/' in mimetype) or ('/xml' in mimetype)
+
+
+def sniff(data):
+    """
+    Guess whether a leading chunk of a file is text: True if it is, False if
+    it's certainly binary and None if the guess is not safe to make.
+    """
+
+    if '\0' in data:
+        return False
+
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by the end of the chunk is fine
+        if e.start < len(data) - 3:
+            return None
+
+    if _BINARY_CONTROLS.search(data):
+        return None
+
+    return True
+
+
+class Classifier(object):
+    """
+    Decides if files are text or binary, memoizing the answer for each
+    (path, mtime, size) so a file is only ever classified once per run.
+
+    In MODE_MAGIC every classification asks libmagic (through the
+    `get_mimetype` callable).  MODE_FAST first goes by file extension and a
+    NUL-byte sniff of the first SNIFF_SIZE bytes, and falls back to libmagic
+    only when neither is conclusive.
+    """
+
+    def __init__(self, get_mimetype, mode = MODE_MAGIC):
+        self.get_mimetype = get_mimetype
+        self.mode = mode
+        self.memo = {}
+        self.lookups = 0
+        self.hits = 0
+        self.by_extension = 0
+        self.by_sniff = 0
+        self.by_magic = 0
+
+    def is_text(self, filename):
+
+        self.lookups += 1
+
+        try:
+            st = os.stat(filename)
+            key = (filename, st.st_mtime, st.st_size)
+        except OSError:
+            key = (filename, None, None)
+
+        if key in self.memo:
+            self.hits += 1
+            return self.memo[key]
+
+        result = None
+        if self.mode == MODE_FAST:
+            result = self._guess(filename)
+
+        if result is None:
+            self.by_magic += 1
+            result = is_text_mime(self.get_mimetype(filename))
+
+        self.memo[key] = result
+        return result
+
+    def _guess(self, filename):
+
+        ext = os.path.splitext(filename)[1].lower()
+        if ext in BINARY_EXTENSIONS:
+            self.by_extension += 1
+            return False
+
+        try:
+            with open(filename, 'rb') as fp:
+                data = fp.read(SNIFF_SIZE)
+        except IOError:
+            return None
+
+        result = sniff(data)
+
+        if result is False:
+            self.by_sniff += 1
+            return False
+
+        if ext in TEXT_EXTENSIONS:
+            self.by_extension += 1
+            return True
+
+        if result is True:
+            self.by_sniff += 1
+
+        return result
+
+    def report(self):
+        hitrate = 0.0
+        if self.lookups:
+            hitrate = 100.0 * self.hits / self.lookups
+        return ("classify: %d lookups, %d memo hits (%.1f%%), "
+            "%d by extension, %d by sniff, %d by libmagic" %
+            (self.lookups, self.hits, hitrate,
+             self.by_extension, self.by_sniff, self.by_magic,))
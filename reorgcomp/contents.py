@@ -0,0 +1,104 @@
+# File: contents.py
+
+import os
+import mmap
+import hashlib
+import contextlib
+
+from collections import OrderedDict
+
+
+# Files at least this big are memory mapped instead of read
+MMAP_SIZE = 1024 * 1024
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+@contextlib.contextmanager
+def open_view(filename):
+    """
+    Give read only access to the whole content of a file without copying it:
+    big files are memory mapped, small ones are simply read.  The view is
+    only valid inside the `with` block.
+    """
+
+    with open(filename, 'rb') as fp:
+
+        size = os.fstat(fp.fileno()).st_size
+
+        if size < MMAP_SIZE:
+            yield fp.read()
+            return
+
+        view = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield view
+        finally:
+            view.close()
+
+
+class ContentCache(object):
+    """
+    Shared provider of file contents.  The most recently used contents are
+    kept, up to `max_bytes` in total, so a file that is compared against many
+    others is only read once; an entry is dropped as soon as the file's size
+    or mtime changes.
+    """
+
+    def __init__(self, max_bytes = DEFAULT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self, filename):
+        (_, data) = self.entries.pop(filename)
+        self.size -= len(data)
+
+    def read(self, filename):
+
+        st = os.stat(filename)
+        stamp = (st.st_size, st.st_mtime)
+
+        entry = self.entries.get(filename)
+        if entry is not None:
+            if entry[0] == stamp:
+                self.hits += 1
+                # Move to the most recently used end
+                del self.entries[filename]
+                self.entries[filename] = entry
+                return entry[1]
+            self._evict(filename)
+
+        self.misses += 1
+
+        with open_view(filename) as view:
+            data = view[:]
+
+        if len(data) <= self.max_bytes:
+            while self.entries and self.size + len(data) > self.max_bytes:
+                self._evict(next(iter(self.entries)))
+            self.entries[filename] = (stamp, data)
+            self.size += len(data)
+
+        return data
+
+    def hash(self, filename):
+        """
+        sha1 of a file's content, hashed straight from the cache or the view
+        so that big files are never copied for it.
+        """
+
+        entry = self.entries.get(filename)
+        if entry is not None:
+            st = os.stat(filename)
+            if entry[0] == (st.st_size, st.st_mtime):
+                return hashlib.sha1(entry[1]).digest()
+
+        with open_view(filename) as view:
+            return hashlib.sha1(view).digest()
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
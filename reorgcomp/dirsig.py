@@ -0,0 +1,138 @@
+# File: dirsig.py
+
+import os
+import hashlib
+
+
+def get_signatures(entries, get_hash):
+    """
+    Merkle style signatures of the directories listed by os.walk() like
+    `entries`: the sha1 of the names and content hashes (from `get_hash`)
+    of a directory's files and of the names and signatures of its
+    subdirectories.  Two directories have the same signature when their
+    whole subtrees are identical, whatever their own names are.  Returns a
+    dict of dirpath -> (signature, number of files in the subtree).
+    """
+
+    children = {}
+    for (dirpath, dirnames, filenames,) in entries:
+        children[dirpath] = (dirnames, filenames)
+
+    signatures = {}
+
+    # A subdirectory's path is always longer than its parent's
+    for dirpath in sorted(children, key=len, reverse=True):
+
+        (dirnames, filenames) = children[dirpath]
+        digest = hashlib.sha1()
+        count = len(filenames)
+
+        for filename in sorted(filenames):
+            digest.update("f\0%s\0%s\0" % (filename,
+                get_hash(os.path.join(dirpath, filename)),))
+
+        for dirname in sorted(dirnames):
+            # Directories that weren't walked (symlinks) only count by name
+            (signature, subcount) = signatures.get(
+                os.path.join(dirpath, dirname), ('', 0))
+            digest.update("d\0%s\0%s\0" % (dirname, signature,))
+            count += subcount
+
+        signatures[dirpath] = (digest.digest(), count)
+
+    return signatures
+
+
+def get_ancestors(path):
+    while True:
+        parent = os.path.dirname(path)
+        if not parent or parent == path:
+            return
+        yield parent
+        path = parent
+
+
+def is_inside(path, dirs):
+    """
+    Whether `path` is one of `dirs` or inside one of them.
+    """
+    if path in dirs:
+        return True
+    for ancestor in get_ancestors(path):
+        if ancestor in dirs:
+            return True
+    return False
+
+
+def get_common_suffix(path1, path2):
+    """
+    The number of trailing path components `path1` and `path2` have in
+    common.
+    """
+    parts1 = path1.split(os.sep)
+    parts2 = path2.split(os.sep)
+    count = 0
+    while (count < min(len(parts1), len(parts2)) and
+           parts1[-1 - count] == parts2[-1 - count]):
+        count += 1
+    return count
+
+
+def match_dirs(old, new, oldbase = '', newbase = ''):
+    """
+    Pair up the directories of two trees, given by their signatures, whose
+    subtrees are identical, the biggest subtrees first and without pairing
+    any directory inside one already paired.  Among identical candidates
+    the one at the same path (relative to `oldbase` and `newbase`) is
+    preferred, then the one with the longest common path suffix.  When that
+    still leaves several, the directory isn't paired: its files are left to
+    be matched one by one.  Returns [(olddir, newdir)].
+    """
+
+    def relative(dirpath, base):
+        if base:
+            return os.path.relpath(dirpath, base)
+        return dirpath
+
+    def rank(olddir, newdir):
+        (oldpath, newpath) = (relative(olddir, oldbase), relative(newdir, newbase))
+        return (oldpath == newpath, get_common_suffix(oldpath, newpath))
+
+    bysignature = {}
+    for (dirpath, (signature, count)) in new.iteritems():
+        bysignature.setdefault(signature, []).append(dirpath)
+    for dirpaths in bysignature.itervalues():
+        dirpaths.sort()
+
+    matches = []
+    matched = set()
+    taken = set()
+    # Directories of the new tree holding a taken one can't be taken anymore
+    holding = set()
+
+    def order(dirpath):
+        return (-old[dirpath][1], dirpath.count(os.sep), dirpath)
+
+    for olddir in sorted(old, key=order):
+
+        (signature, count) = old[olddir]
+        if count == 0 or is_inside(olddir, matched):
+            continue
+
+        candidates = [newdir for newdir in bysignature.get(signature, ())
+                      if newdir not in holding and not is_inside(newdir, taken)]
+        if not candidates:
+            continue
+
+        ranks = [rank(olddir, candidate) for candidate in candidates]
+        best = max(ranks)
+        if ranks.count(best) > 1:
+            continue
+        newdir = candidates[ranks.index(best)]
+
+        matches.append((olddir, newdir))
+        matched.add(olddir)
+        taken.add(newdir)
+        holding.update(get_ancestors(newdir))
+
+    return matches
@@ -0,0 +1,110 @@
+# File: minhash.py
+
+import re
+import random
+import binascii
+
+
+SHINGLE_SIZE = 4
+NUM_BANDS = 16
+ROWS_PER_BAND = 4
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_token_regex = re.compile(r'\w+|[^\w\s]')
+
+
+def get_shingles(data, size = SHINGLE_SIZE):
+    """
+    The set of (hashed) runs of `size` consecutive tokens in `data`, so that
+    formatting changes don't affect the result.
+    """
+    tokens = _token_regex.findall(data)
+    if not tokens:
+        return set()
+    if len(tokens) < size:
+        return set([binascii.crc32(' '.join(tokens)) & _MAX_HASH])
+    return set(binascii.crc32(' '.join(tokens[i:i + size])) & _MAX_HASH
+               for i in xrange(len(tokens) - size + 1))
+
+
+class MinHashIndex(object):
+    """
+    Locality sensitive hashing of MinHash signatures: a signature of
+    NUM_BANDS * ROWS_PER_BAND values is split into bands, and two documents
+    become candidates of each other when all the values of at least one band
+    agree.  With the defaults a document is proposed with a probability of
+    1 - (1 - s**4)**16 for a (Jaccard) similarity s of the shingles: about
+    0.99 at 0.7, 0.64 at 0.5 and 0.12 at 0.3.  The cost of a query doesn't
+    depend on how many documents are indexed.
+
+    The signatures are one permutation MinHashes: every shingle is hashed
+    once and only counts towards the minimum of the slot its hash falls in,
+    so making one costs a single pass over the shingles rather than one per
+    value of the signature.
+    """
+
+    def __init__(self, bands = NUM_BANDS, rows = ROWS_PER_BAND, seed = 1):
+        self.bands = bands
+        self.rows = rows
+        rng = random.Random(seed)
+        self.a = rng.randint(1, _MERSENNE_PRIME - 1)
+        self.b = rng.randint(0, _MERSENNE_PRIME - 1)
+        self.buckets = {}
+
+    def signature(self, data):
+        shingles = get_shingles(data)
+        if not shingles:
+            return None
+
+        (a, b) = (self.a, self.b)
+        size = self.bands * self.rows
+        slots = [None] * size
+        for x in shingles:
+            (value, slot) = divmod((a * x + b) % _MERSENNE_PRIME, size)
+            current = slots[slot]
+            if current is None or value < current:
+                slots[slot] = value
+
+        # Slots no shingle fell in borrow the value of the next filled one,
+        # told apart by the distance they borrowed it from, so that similar
+        # documents still agree on them.
+        signature = []
+        for slot in xrange(size):
+            distance = 0
+            while slots[(slot + distance) % size] is None:
+                distance += 1
+            signature.append(slots[(slot + distance) % size] + distance * _MERSENNE_PRIME)
+        return signature
+
+    def _bands(self, signature):
+        for band in xrange(self.bands):
+            start = band * self.rows
+            yield (band, tuple(signature[start:start + self.rows]))
+
+    def add(self, key, data):
+        self.add_signature(key, self.signature(data))
+
+    def add_signature(self, key, signature):
+        """
+        Index `key` by a signature already made with signature(), by this
+        index or another one with the same parameters.
+        """
+        if signature is None:
+            return
+        for band in self._bands(signature):
+            self.buckets.setdefault(band, []).append(key)
+
+    def query(self, data):
+        signature = self.signature(data)
+        if signature is None:
+            return []
+        candidates = []
+        seen = set()
+        for band in self._bands(signature):
+            for key in self.buckets.get(band, ()):
+                if key not in seen:
+                    seen.add(key)
+                    candidates.append(key)
+        return candidates
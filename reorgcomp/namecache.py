@@ -0,0 +1,137 @@
+# File: namecache.py
+
+import os
+import time
+
+from collections import OrderedDict
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Seconds between two checks of a cached tree for changes
+DEFAULT_CHECK_INTERVAL = 5.0
+
+# Rough per-object costs used to estimate the memory held by a tree
+_NAME_OVERHEAD = 80
+_DIR_OVERHEAD = 60
+_REF_SIZE = 8
+
+
+class _Tree(object):
+
+    def __init__(self, names, mtimes, cost):
+        self.names = names
+        self.mtimes = mtimes
+        self.cost = cost
+        self.checked = time.time()
+
+
+class NameCache(object):
+    """
+    Maps the file names of scanned directory trees to the directories they
+    appear in.  Trees are kept in least recently used order and evicted once
+    their estimated memory use goes over `max_bytes`, except for the last one
+    scanned which is kept even if it alone is over.  A tree is rescanned
+    when the mtime of any of its directories has changed, which is checked
+    at most every `check_interval` seconds (never if None).
+    """
+
+    def __init__(self, walk = os.walk, max_bytes = DEFAULT_MAX_BYTES,
+                 check_interval = DEFAULT_CHECK_INTERVAL):
+        self.walk = walk
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.trees = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _scan(self, scandir):
+        names = {}
+        mtimes = {}
+        cost = 0
+        for (dirpath, dirnames, filenames,) in self.walk(scandir):
+            try:
+                mtimes[dirpath] = os.stat(dirpath).st_mtime
+            except OSError:
+                mtimes[dirpath] = None
+            cost += len(dirpath) + _DIR_OVERHEAD
+            for filename in filenames:
+                dirs = names.get(filename)
+                if dirs is None:
+                    dirs = names[filename] = []
+                    cost += len(filename) + _NAME_OVERHEAD
+                dirs.append(dirpath)
+                cost += _REF_SIZE
+        return _Tree(names, mtimes, cost)
+
+    def _is_stale(self, tree):
+        for (dirpath, mtime) in tree.mtimes.iteritems():
+            try:
+                if os.stat(dirpath).st_mtime != mtime:
+                    return True
+            except OSError:
+                if mtime is not None:
+                    return True
+        return False
+
+    def _drop(self, scandir):
+        tree = self.trees.pop(scandir)
+        self.size -= tree.cost
+
+    def _get_tree(self, scandir):
+
+        tree = self.trees.get(scandir)
+
+        if tree is not None and self.check_interval is not None:
+            if time.time() - tree.checked >= self.check_interval:
+                stale = self._is_stale(tree)
+                # From the end of the check, which on a slow filesystem can
+                # take longer than the interval itself
+                tree.checked = time.time()
+                if stale:
+                    self.invalidations += 1
+                    self._drop(scandir)
+                    tree = None
+
+        if tree is not None:
+            self.hits += 1
+            del self.trees[scandir]
+            self.trees[scandir] = tree
+            return tree
+
+        self.misses += 1
+        tree = self._scan(scandir)
+
+        while self.trees and self.size + tree.cost > self.max_bytes:
+            self.evictions += 1
+            self._drop(next(iter(self.trees)))
+
+        # Even a tree bigger than the whole budget is kept, the lookups that
+        # follow would otherwise walk it again every time.
+        self.trees[scandir] = tree
+        self.size += tree.cost
+
+        return tree
+
+    def get(self, scandir, filename):
+        return self._get_tree(scandir).names.get(filename, [])
+
+    def invalidate(self, scandir = None):
+        if scandir is None:
+            self.trees.clear()
+            self.size = 0
+        elif scandir in self.trees:
+            self._drop(scandir)
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hitrate = 0.0
+        if lookups:
+            hitrate = 100.0 * self.hits / lookups
+        return ("names: %d lookups, %d hits (%.1f%%), %d scans, "
+            "%d evictions, %d invalidations, ~%d KB held" %
+            (lookups, self.hits, hitrate, self.misses,
+             self.evictions, self.invalidations, self.size / 1024,))
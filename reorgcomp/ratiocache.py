@@ -0,0 +1,111 @@
+# File: ratiocache.py
+
+import os
+import hashlib
+import sqlite3
+
+
+# Results are committed in batches of this many
+COMMIT_INTERVAL = 1000
+
+
+class RatioCache(object):
+    """
+    Persistent store of similarity ratios in an SQLite file, keyed by the
+    sha1 of both contents and the scorer that compared them, so that a pair
+    is only ever scored once across stages and runs.  A comparison that was
+    cut off only tells that the ratio is below the cutoff: it is stored as
+    that bound (`exact` = 0) and answers later lookups with the same or a
+    higher cutoff.
+
+    Worker processes forked from the one that opened the cache get their own
+    connection and commit every result, as they can be terminated at any
+    time.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = None
+        self.pid = None
+        self.owner = os.getpid()
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+        self.digests = []
+
+    def _connect(self):
+        if self.db is None or self.pid != os.getpid():
+            self.db = sqlite3.connect(self.filename, timeout = 60)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS ratios ("
+                "hash1 TEXT, hash2 TEXT, scorer TEXT, ratio REAL, exact INTEGER, "
+                "PRIMARY KEY (hash1, hash2, scorer))")
+            self.pid = os.getpid()
+            self.pending = 0
+        return self.db
+
+    def digest(self, data):
+        # The same content is usually compared against several others in a
+        # row, so remember the last couple of digests.
+        for (known, digest) in self.digests:
+            if known is data:
+                return digest
+        digest = hashlib.sha1(data).hexdigest()
+        self.digests = [(data, digest)] + self.digests[:1]
+        return digest
+
+    def get(self, hash1, hash2, scorer, cutoff = None):
+        """
+        Returns (found, ratio), `ratio` being None when it is below `cutoff`.
+        """
+
+        row = self._connect().execute(
+            "SELECT ratio, exact FROM ratios WHERE hash1 = ? AND hash2 = ? AND scorer = ?",
+            (hash1, hash2, scorer,)).fetchone()
+
+        if row is not None:
+            (ratio, exact) = row
+            if exact:
+                self.hits += 1
+                if cutoff is not None and ratio < cutoff:
+                    return (True, None)
+                return (True, ratio)
+            if cutoff is not None and cutoff >= ratio:
+                self.hits += 1
+                return (True, None)
+
+        self.misses += 1
+        return (False, None)
+
+    def put(self, hash1, hash2, scorer, cutoff, ratio):
+
+        (value, exact) = (ratio, 1)
+        if ratio is None:
+            (value, exact) = (cutoff, 0)
+
+        db = self._connect()
+        db.execute("INSERT OR REPLACE INTO ratios VALUES (?, ?, ?, ?, ?)",
+                   (hash1, hash2, scorer, value, exact,))
+
+        self.pending += 1
+        if self.pid != self.owner or self.pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        if self.db is not None and self.pid == os.getpid() and self.pending:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        self.commit()
+        if self.db is not None and self.pid == os.getpid():
+            self.db.close()
+        self.db = None
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hitrate = 0.0
+        if lookups:
+            hitrate = 100.0 * self.hits / lookups
+        return ("ratios: %d lookups, %d cached (%.1f%%)" %
+            (lookups, self.hits, hitrate,))
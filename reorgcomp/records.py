@@ -0,0 +1,129 @@
+# File: records.py
+
+import os
+import json
+import base64
+import marshal
+
+from pprint import pformat
+
+from unrepr import unrepr
+
+
+FORMAT_REPR = "repr"
+FORMAT_JSONL = "jsonl"
+FORMAT_MARSHAL = "marshal"
+
+EXTENSIONS = {
+    '.jsonl': FORMAT_JSONL,
+    '.marshal': FORMAT_MARSHAL,
+}
+
+# JSON strings are unicode: byte strings (paths) that aren't valid UTF-8 are
+# stored as {BYTES_KEY: base64}, a NUL can't be part of a path.
+BYTES_KEY = "\0bytes"
+
+
+def get_format(filename):
+    """
+    The record format of a file goes by its extension, anything that isn't
+    known is the original pformat()/unrepr() text.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    return EXTENSIONS.get(ext, FORMAT_REPR)
+
+
+def _to_json(obj):
+    if isinstance(obj, str):
+        try:
+            obj.decode('utf-8')
+        except UnicodeDecodeError:
+            return {BYTES_KEY: base64.b64encode(obj)}
+        return obj
+    if isinstance(obj, (list, tuple)):
+        return [_to_json(item) for item in obj]
+    if isinstance(obj, dict):
+        return dict((_to_json(key), _to_json(value))
+                    for (key, value) in obj.iteritems())
+    return obj
+
+
+def _dump_json(record):
+    try:
+        return json.dumps(record, separators=(',', ':'))
+    except UnicodeDecodeError:
+        # Only the records holding such strings pay for the conversion
+        return json.dumps(_to_json(record), separators=(',', ':'))
+
+
+def _from_json(obj, toplevel = False):
+    # JSON has no tuples: records and the (path, ratio) style items inside
+    # them come back as tuples, arrays of arrays (and empty arrays) as lists.
+    if isinstance(obj, list):
+        items = [_from_json(item) for item in obj]
+        if toplevel:
+            return tuple(items)
+        if not items or all(isinstance(item, (list, tuple)) for item in items):
+            return items
+        return tuple(items)
+    if isinstance(obj, dict):
+        if len(obj) == 1 and BYTES_KEY in obj:
+            return base64.b64decode(obj[BYTES_KEY])
+        return dict((_from_json(key), _from_json(value))
+                    for (key, value) in obj.iteritems())
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    return obj
+
+
+def write_records(filename, records):
+    """
+    Write an iterable of records to `filename`.  The jsonl and marshal formats
+    are written one record at a time as `records` is consumed.
+    """
+
+    fmt = get_format(filename)
+
+    with open(filename, 'wb') as fp:
+
+        if fmt == FORMAT_JSONL:
+            for record in records:
+                fp.write(_dump_json(record))
+                fp.write('\n')
+
+        elif fmt == FORMAT_MARSHAL:
+            for record in records:
+                marshal.dump(record, fp)
+
+        else:
+            if not isinstance(records, (list, tuple)):
+                records = list(records)
+            fp.write(pformat(records, 0, 80))
+
+
+def iter_records(filename):
+    """
+    Yield the records stored in `filename` one at a time.  The legacy repr
+    format has to be parsed as a whole before the first record is available.
+    """
+
+    fmt = get_format(filename)
+
+    with open(filename, 'rb') as fp:
+
+        if fmt == FORMAT_JSONL:
+            for line in fp:
+                if line.strip():
+                    yield _from_json(json.loads(line), toplevel=True)
+
+        elif fmt == FORMAT_MARSHAL:
+            while True:
+                try:
+                    record = marshal.load(fp)
+                except EOFError:
+                    break
+                yield record
+
+        else:
+            for record in unrepr(fp.read()):
+                yield record
@@ -3,20 +3,37 @@
 import re
 import os
 import sys
+import time
 import difflib
+import shutil
 import hashlib
+import tempfile
+import itertools
 import subprocess
+import multiprocessing
+import cProfile
 import argparse
 import textwrap
 
-from pprint import pprint, pformat
+from pprint import pprint
 
 from difflib import SequenceMatcher
 
 # https://pypi.python.org/pypi/python-magic/
 import magic
 
-from unrepr import unrepr
+import scanindex
+import classify
+import records
+import minhash
+import contents
+import namecache
+import assign
+import replace
+import ratiocache
+import stats
+import dirsig
+import scanner
 
 
 GLOBAL_EXCLUDE = None
@@ -24,18 +41,48 @@ GLOBAL_INCLUDE = None
 
 PRETEND_OPS = False
 
+SCORER_CHARS = "chars"
+SCORER_LINES = "lines"
+SCORER_AUTO = "auto"
+
+SCORERS = [
+    SCORER_CHARS,
+    SCORER_LINES,
+    SCORER_AUTO,
+]
+
+SCORER = SCORER_CHARS
+
+# With the 'auto' scorer, old files larger than this are compared line by line
+AUTO_SCORER_LINES_SIZE = 64 * 1024
+
+MIN_RATIO = None
+BEST_MATCH_ONLY = False
+FIND_RENAMES = False
+FIND_SIMILAR = False
+
+FIND_DIRS = False
+
+AUTO_ACCEPT = None
+AUTO_MARGIN = 0.1
+
+INDEX_DIR = None
+
 _fixname_renames = []
 
+_fixname_replacer = replace.MultiReplacer([])
+
+def get_fixname_replacer():
+    global _fixname_replacer
+    if _fixname_replacer.renames != _fixname_renames:
+        _fixname_replacer = replace.MultiReplacer(_fixname_renames)
+    return _fixname_replacer
+
 def fixname(s):
-    for (from_, to_) in _fixname_renames:
-        s = s.replace(from_, to_)
-    return s
+    return get_fixname_replacer().replace(s)
 
 def fixnameable(s):
-    for (target, _) in _fixname_renames:
-        if target in s:
-            return True
-    return False
+    return get_fixname_replacer().search(s)
 
 def longestpath(x, y):
     return -cmp(len(x[0]) + len(x[1]), len(y[0]) + len(y[1]))
@@ -43,10 +90,12 @@ def longestpath(x, y):
 
 _rename_target = "."
 
-def rename_dirs(
-    os_walk = os.walk,
-    os_rename = os.rename
-    ):
+STEP_DIR = "dir"
+STEP_FILE = "file"
+STEP_CONTENT = "content"
+
+
+def plan_dir_renames(os_walk = os.walk):
 
     paths = []
 
@@ -56,52 +105,314 @@ def rename_dirs(
 
     paths.sort(longestpath)
 
+    steps = []
+
     for (dirpath, dirname) in paths:
 
         newname = fixname(dirname)
         if newname != dirname:
+            steps.append((STEP_DIR,
+                          os.path.join(dirpath, dirname),
+                          os.path.join(dirpath, newname),))
 
-            oldname = os.path.join(dirpath, dirname)
-            newname = os.path.join(dirpath, newname)
-            print "Renaming '%s' -> '%s'" % (oldname, newname,)
+    return steps
 
-            if not PRETEND_OPS:
-                os_rename(oldname, newname)
 
+def print_step(step):
 
-def is_text_mimetype(filename):
+    if step[0] == STEP_DIR:
+        print "Renaming '%s' -> '%s'" % (step[1], step[2],)
+    elif step[0] == STEP_FILE:
+        print "Renaming '%s' to '%s'" % (step[1], step[2],)
+    else:
+        print "Replacing content in '%s'" % (step[1],)
+
+
+def rename_dirs(
+    os_walk = os.walk,
+    os_rename = os.rename
+    ):
+
+    for step in plan_dir_renames(os_walk):
+
+        print_step(step)
+
+        if not PRETEND_OPS:
+            os_rename(step[1], step[2])
+
+
+_scan_indexes = {}
+
+def get_scan_index(base):
+
+    if INDEX_DIR is None:
+        return None
+
+    if base not in _scan_indexes:
+        index = scanindex.ScanIndex(base, scanindex.get_index_filename(INDEX_DIR, base))
+        index.load()
+        index.refresh()
+        sys.stderr.write("index: %s: %d files reused, %d rescanned\n" %
+            (base, index.reused, index.rescanned,))
+        _scan_indexes[base] = index
+
+    return _scan_indexes[base]
+
+
+def find_scan_index(filename):
+    for index in _scan_indexes.values():
+        if index.relpath(filename) is not None:
+            return index
+    return None
+
+
+def save_scan_indexes():
+    for index in _scan_indexes.values():
+        index.save()
+
+
+_scanner = None
+
+
+def walk(base):
+
+    index = get_scan_index(base)
+    if index is None:
+        if _scanner is not None:
+            return _scanner.walk(base)
+        return os.walk(base)
+
+    return index.walk()
+
+
+def get_mimetype(filename):
+
+    index = find_scan_index(filename)
+    if index is not None:
+        mimetype = index.get(filename, scanindex.FIELD_MIMETYPE)
+        if mimetype is not None:
+            return mimetype
 
     mimetype = magic.from_file(filename, mime=True)
-    return ('text/' in mimetype) or ('/xml' in mimetype)
+
+    if index is not None:
+        index.set(filename, scanindex.FIELD_MIMETYPE, mimetype)
+
+    return mimetype
 
 
-def rename_files():
+_classifier = classify.Classifier(get_mimetype)
+
+_contents = contents.ContentCache()
+
+def read_file(filename):
+    return _contents.read(filename)
+
+def is_text_mimetype(filename):
+    return _classifier.is_text(filename)
+
+
+def fixnameable_file(filename):
+    with open(filename, 'rb') as fp:
+        return get_fixname_replacer().search_file(fp)
+
+
+def fixname_file(filename):
+    """
+    Rewrite the content of a file with the renames applied.  The new content
+    is streamed to a temporary file next to it which then replaces it, so a
+    crash never leaves a half written file behind.
+    """
+
+    (fd, tmpname) = tempfile.mkstemp(dir=os.path.dirname(filename) or '.',
+                                     prefix='.reorg')
+    try:
+        with os.fdopen(fd, 'wb') as outfp:
+            with open(filename, 'rb') as infp:
+                get_fixname_replacer().replace_file(infp, outfp)
+        shutil.copymode(filename, tmpname)
+        os.rename(tmpname, filename)
+    except:
+        os.remove(tmpname)
+        raise
+
+
+def get_renamed_dir(dirpath):
+    """
+    The path a directory under the rename target has once all the directory
+    renames of the plan are done: every component is renamed on its own.
+    """
+
+    relpath = os.path.relpath(dirpath, _rename_target)
+    if relpath == os.curdir:
+        return dirpath
+
+    parts = [fixname(part) for part in relpath.split(os.sep)]
+    return os.path.join(_rename_target, *parts)
+
+
+def plan_file_renames(os_walk = os.walk):
+    """
+    The file renames and content rewrites that follow the directory renames,
+    with the paths they will have by then.  Text files are checked for the
+    renames now, so the plan only lists the files that really change.
+    """
+
+    steps = []
+
+    for (dirpath, dirnames, filenames,) in os_walk(_rename_target):
+
+        renamed_dir = get_renamed_dir(dirpath)
 
-    for (dirpath, dirnames, filenames,) in os.walk(_rename_target):
         for filename in filenames:
 
-            oldname = os.path.join(dirpath, filename)
+            oldname = os.path.join(renamed_dir, filename)
             newname = fixname(oldname)
 
             if oldname != newname:
-                print "Renaming '%s' to '%s'" % (oldname, newname,)
-                os.rename(oldname, newname)
+                steps.append((STEP_FILE, oldname, newname,))
+
+            current = os.path.join(dirpath, filename)
+            if is_text_mimetype(current) and fixnameable_file(current):
+                steps.append((STEP_CONTENT, newname,))
+
+    return steps
+
+
+def plan_renames(os_walk = os.walk):
+    return plan_dir_renames(os_walk) + plan_file_renames(os_walk)
+
 
-            if is_text_mimetype(newname):
-                with open(newname) as fp:
-                    data = fp.read()
-                if fixnameable(data):
-                    data = fixname(data)
-                    print "Replacing content in '%s'" % (newname,)
-                    with open(newname, 'w') as fp:
-                        fp.write(data)
+def read_journal(filename):
+
+    done = set()
+    if os.path.exists(filename):
+        with open(filename) as fp:
+            for line in fp:
+                if line.strip():
+                    done.add(int(line))
+    return done
+
+
+def journal_step(journal, index):
+    """
+    Record step `index` of a plan as done in the `journal` file.  Each step
+    is a single line appended with O_APPEND, so processes can journal the
+    steps they carry out themselves without mixing up their lines.
+    """
+    fd = os.open(journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+    try:
+        os.write(fd, "%d\n" % (index,))
+    finally:
+        os.close(fd)
+
+
+def _fixname_file_job(args):
+    (index, filename, journal) = args
+    fixname_file(filename)
+    # Right away, by the worker: a result still on its way to the parent is
+    # lost if the run is interrupted, and the rewrite would be done again.
+    if journal:
+        journal_step(journal, index)
+    return (index, filename)
+
+
+def execute_plan(plan, journal = None, done = (), jobs = 1):
+    """
+    Apply the steps of a rename plan that aren't in `done`: the renames in
+    order, then the content rewrites, which are independent of each other,
+    on `jobs` processes.  The index of each completed step is appended to
+    the `journal` file (see journal_step) as soon as it is done, so an
+    interrupted run can pick up where it stopped.
+    """
+
+    def finished(index):
+        if journal:
+            journal_step(journal, index)
+
+    rewrites = []
+
+    for (index, step) in enumerate(plan):
+
+        if index in done:
+            continue
+
+        if step[0] == STEP_CONTENT:
+            rewrites.append((index, step[1], journal))
+            continue
+
+        print_step(step)
+
+        # A rename that went through just before an interruption
+        if os.path.exists(step[2]) and not os.path.exists(step[1]):
+            finished(index)
+            continue
+
+        os.rename(step[1], step[2])
+        finished(index)
+
+    pool = None
+
+    if jobs > 1 and len(rewrites) > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(_fixname_file_job, rewrites)
+    else:
+        results = itertools.imap(_fixname_file_job, rewrites)
+
+    progress = Progress("rename", len(rewrites))
+
+    try:
+        for (index, filename) in results:
+            print_step((STEP_CONTENT, filename,))
+            progress.tick()
+        if pool:
+            pool.close()
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    progress.done()
+
+
+def rename_tree(planfile = None, resume = False, jobs = 1):
+    """
+    Plan every rename and content rewrite under the rename target, save the
+    plan to `planfile` if given, and carry it out (or, with --pretend, just
+    list it).  With `resume` an existing plan file is executed again,
+    skipping the steps its journal records as done.
+    """
+
+    journal = None
+    if planfile:
+        journal = planfile + ".done"
+
+    if resume and planfile and os.path.exists(planfile):
+        plan = read_input(planfile)
+        done = read_journal(journal)
+    else:
+        plan = plan_renames()
+        done = set()
+        if planfile:
+            save_output(planfile, plan)
+            if os.path.exists(journal):
+                os.remove(journal)
+
+    if PRETEND_OPS:
+        for (index, step) in enumerate(plan):
+            if index not in done:
+                print_step(step)
+        return plan
+
+    execute_plan(plan, journal, done, jobs)
+    return plan
 
 
 def get_uniqueness_of_files():
 
     names = {}
 
-    for (dirpath, dirnames, filenames,) in os.walk('.'):
+    for (dirpath, dirnames, filenames,) in walk('.'):
         for filename in filenames:
             ls = names.setdefault(filename, [])
             ls.append(dirpath)
@@ -121,12 +432,113 @@ def get_pairs(ls):
                 yield x, y
 
 
-def get_ratio(data1, data2):
-    return SequenceMatcher(str.isspace, data1, data2).ratio()
+_ratio_cache = None
+
+
+def get_ratio(data1, data2, cutoff = None):
+    """
+    Return the similarity ratio of two strings, or None if `cutoff` is given
+    and the ratio is below it.  The cheap upper bounds (length ratio, then
+    character or line histogram) are checked first so that most candidates
+    below `cutoff` never run the full (quadratic) comparison, and with
+    --ratio-cache a pair that was scored before isn't compared again.
+
+    The 'auto' scorer goes by the size of `data1`, the old file, so that all
+    the candidates of a file get ratios of the same scorer: the two don't
+    give comparable ratios for the same pair.
+    """
+
+    if cutoff is not None:
+        total = len(data1) + len(data2)
+        if total and 2.0 * min(len(data1), len(data2)) / total < cutoff:
+            return None
+
+    scorer = SCORER
+    if scorer == SCORER_AUTO:
+        scorer = SCORER_CHARS
+        if len(data1) > AUTO_SCORER_LINES_SIZE:
+            scorer = SCORER_LINES
+
+    if _ratio_cache is not None:
+        key = (_ratio_cache.digest(data1), _ratio_cache.digest(data2), scorer,)
+        (found, ratio) = _ratio_cache.get(*key, cutoff = cutoff)
+        if found:
+            return ratio
 
+    if scorer == SCORER_LINES:
+        ratio = get_line_ratio(data1, data2, cutoff)
+    else:
+        ratio = get_char_ratio(data1, data2, cutoff)
 
-def get_ratio_of_files(file1, file2):
-    return SequenceMatcher(str.isspace, open(file1).read(), open(file2).read()).ratio()
+    if _ratio_cache is not None:
+        _ratio_cache.put(*key, cutoff = cutoff, ratio = ratio)
+
+    return ratio
+
+
+def get_char_ratio(data1, data2, cutoff = None):
+
+    matcher = SequenceMatcher(str.isspace, data1, data2)
+
+    if cutoff is not None:
+        if matcher.quick_ratio() < cutoff:
+            return None
+
+    ratio = matcher.ratio()
+
+    if cutoff is not None and ratio < cutoff:
+        return None
+
+    return ratio
+
+
+def get_line_ratio(data1, data2, cutoff = None):
+    """
+    Similarity ratio computed on whole lines instead of characters: the lines
+    are hashed and the hash sequences matched, which is far cheaper than the
+    character comparison for big files.  Matched lines are weighted by their
+    length, but the ratio isn't on the same scale as get_char_ratio()'s: for
+    the same files the two can be far apart, they can't be compared.
+    """
+
+    total = len(data1) + len(data2)
+    if not total:
+        return 1.0
+
+    lines1 = data1.splitlines(True)
+    lines2 = data2.splitlines(True)
+    hashes1 = [hash(line) for line in lines1]
+    hashes2 = [hash(line) for line in lines2]
+
+    if cutoff is not None:
+        # No more characters can match than those of the lines both share
+        counts = {}
+        for (h, line) in zip(hashes2, lines2):
+            counts[h] = counts.get(h, 0) + 1
+        shared = 0
+        for (h, line) in zip(hashes1, lines1):
+            if counts.get(h, 0) > 0:
+                counts[h] -= 1
+                shared += len(line)
+        if 2.0 * shared / total < cutoff:
+            return None
+
+    matcher = SequenceMatcher(None, hashes1, hashes2, autojunk=False)
+
+    matched = 0
+    for (i, j, n) in matcher.get_matching_blocks():
+        matched += sum(len(line) for line in lines1[i:i + n])
+
+    ratio = 2.0 * matched / total
+
+    if cutoff is not None and ratio < cutoff:
+        return None
+
+    return ratio
+
+
+def get_ratio_of_files(file1, file2, cutoff = None):
+    return get_ratio(read_file(file1), read_file(file2), cutoff)
 
 def are_file_names_unique():
 
@@ -140,10 +552,10 @@ def are_file_names_unique():
             for (dirx, diry) in get_pairs(names[filen]):
 
                 pathx = os.path.join(dirx, filen)
-                datax = open(pathx).read()
+                datax = read_file(pathx)
 
                 pathy = os.path.join(diry, filen)
-                datay = open(pathy).read()
+                datay = read_file(pathy)
 
                 hashx = hashlib.sha1(datax).digest()
                 hashy = hashlib.sha1(datay).digest()
@@ -158,65 +570,469 @@ def are_file_names_unique():
                         print "Binary files where different..."
 
 
-_get_matching_names_cache = {}
+_names_cache = namecache.NameCache(walk)
 
 def get_dirs_with_filename(scandir, target):
+    return _names_cache.get(scandir, target)
+
+
+def get_file_hash(filename):
+
+    index = find_scan_index(filename)
+    if index is not None:
+        digest = index.get(filename, scanindex.FIELD_HASH)
+        if digest is not None:
+            return digest
+
+    digest = _contents.hash(filename)
 
-    if scandir not in _get_matching_names_cache:
-        _get_matching_names_cache[scandir] = {}
-        d = _get_matching_names_cache[scandir]
-        for (dirpath, dirnames, filenames,) in os.walk(scandir):
-            for filename in filenames: 
-                d.setdefault(filename, []).append(dirpath)
+    if index is not None:
+        index.set(filename, scanindex.FIELD_HASH, digest)
 
-    d = _get_matching_names_cache[scandir]
-    if target in d:
-        return d[target]
+    return digest
+
+
+_get_hash_index_cache = {}
+
+def get_file_hashes(filenames):
+    """
+    get_file_hash() of all `filenames`, through the concurrent scanner if
+    --scan-threads is given.
+    """
+    if _scanner is not None:
+        return _scanner.map(get_file_hash, filenames)
+    return map(get_file_hash, filenames)
+
+
+def get_files_with_hash(scandir, digest):
+
+    if scandir not in _get_hash_index_cache:
+        _get_hash_index_cache[scandir] = {}
+        d = _get_hash_index_cache[scandir]
+        fullpaths = [os.path.join(dirpath, filename)
+                     for (dirpath, dirnames, filenames,) in walk(scandir)
+                     for filename in filenames]
+        for (fullpath, filehash) in zip(fullpaths, get_file_hashes(fullpaths)):
+            d.setdefault(filehash, []).append(fullpath)
+
+    d = _get_hash_index_cache[scandir]
+    if digest in d:
+        return d[digest]
 
     return []
-    
+
+
+_get_similarity_index_cache = {}
+
+def _similarity_signature_job(fullpath):
+    if not is_text_mimetype(fullpath):
+        return None
+    return minhash.MinHashIndex().signature(read_file(fullpath))
+
+
+def get_similar_files(scandir, data, jobs = 1):
+    """
+    Files of scandir whose content is likely to be similar to `data`, found
+    through a MinHash/LSH index of all the text files in scandir.  The index
+    is built on first use, with `jobs` processes making the signatures.
+    """
+
+    if scandir not in _get_similarity_index_cache:
+        index = minhash.MinHashIndex()
+        fullpaths = [os.path.join(dirpath, filename)
+                     for (dirpath, dirnames, filenames,) in walk(scandir)
+                     for filename in filenames]
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                chunksize = max(1, min(64, len(fullpaths) / (jobs * 8)))
+                signatures = pool.map(_similarity_signature_job, fullpaths, chunksize)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            signatures = itertools.imap(_similarity_signature_job, fullpaths)
+        for (fullpath, signature) in itertools.izip(fullpaths, signatures):
+            index.add_signature(fullpath, signature)
+        _get_similarity_index_cache[scandir] = index
+
+    if data is None:
+        return []
+
+    return _get_similarity_index_cache[scandir].query(data)
+
+
+# New directories already matched by directory moves (see detect_moves)
+_claimed_dirs = set()
+
+def is_claimed(fullpath):
+    return bool(_claimed_dirs) and dirsig.is_inside(fullpath, _claimed_dirs)
+
+
+def get_identical_files(basenew, oldfilename, dataold):
+    """
+    The files of basenew with the same content as the old file: those of
+    any name through the content hash index of basenew with --find-renames,
+    otherwise only those with the same name, which are the only ones to be
+    matched and don't need all of basenew to be hashed.
+    """
+
+    digest = hashlib.sha1(dataold).digest()
+
+    if FIND_RENAMES:
+        return set(fullpath for fullpath in get_files_with_hash(basenew, digest)
+                   if not is_claimed(fullpath))
+
+    identical = set()
+    for dirpath in get_dirs_with_filename(basenew, oldfilename):
+        fullpath = os.path.join(dirpath, oldfilename)
+        if is_claimed(fullpath):
+            continue
+        try:
+            if os.path.getsize(fullpath) != len(dataold):
+                continue
+        except OSError:
+            continue
+        if get_file_hash(fullpath) == digest:
+            identical.add(fullpath)
+    return identical
+
 
 def detect_move(basenew = None, oldfile = None):
     matches = []
     oldfiledir, oldfilename = os.path.split(oldfile)
-    dataold = open(oldfile).read()
+    dataold = read_file(oldfile)
+    # Byte-identical files are an exact match and never need to be diffed.
+    identical = get_identical_files(basenew, oldfilename, dataold)
+    # Candidates that provably can't reach the cutoff are never fully scored
+    # and are left out of the matches.  Every identical file ends up in the
+    # matches with a ratio of 1.0, so nothing below that can be the best.
+    cutoff = MIN_RATIO
+    if identical and BEST_MATCH_ONLY:
+        cutoff = 1.0
     for dirpath in get_dirs_with_filename(basenew, oldfilename):
         fullpath = os.path.join(dirpath, oldfilename)
+        if is_claimed(fullpath):
+            continue
         ratio = -1
-        if is_text_mimetype(fullpath):
-            data = open(fullpath).read()
-            ratio = get_ratio(dataold, data)
+        if fullpath in identical:
+            ratio = 1.0
+        elif is_text_mimetype(fullpath):
+            data = read_file(fullpath)
+            ratio = get_ratio(dataold, data, cutoff)
+            if ratio is None:
+                continue
+            if BEST_MATCH_ONLY and (cutoff is None or ratio > cutoff):
+                cutoff = ratio
         matches.append( (fullpath, ratio) )
-    return sorted(matches, cmp=lambda x,y: -cmp(x[1], y[1]))
+    if FIND_RENAMES:
+        for fullpath in identical:
+            if os.path.basename(fullpath) != oldfilename:
+                matches.append( (fullpath, 1.0) )
+    if FIND_SIMILAR and is_text_mimetype(oldfile):
+        # Files with another name are only proposed by the similarity index,
+        # and then scored like any other candidate.
+        seen = set(fullpath for (fullpath, _) in matches)
+        for fullpath in get_similar_files(basenew, dataold):
+            if (fullpath in seen or os.path.basename(fullpath) == oldfilename or
+                    is_claimed(fullpath)):
+                continue
+            ratio = get_ratio(dataold, read_file(fullpath), cutoff)
+            if ratio is None:
+                continue
+            if BEST_MATCH_ONLY and (cutoff is None or ratio > cutoff):
+                cutoff = ratio
+            matches.append( (fullpath, ratio) )
+    matches = sorted(matches, cmp=lambda x,y: -cmp(x[1], y[1]))
+    if BEST_MATCH_ONLY:
+        matches = matches[:1]
+    return matches
+
+
+class Progress(object):
+    """
+    Periodically report how many items of a long running operation have been
+    processed, and at what rate, on stderr.
+    """
+
+    def __init__(self, label, total, interval = 1.0, stream = None):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.count = 0
+        self.start = time.time()
+        self.last = self.start
+
+    def rate(self):
+        elapsed = time.time() - self.start
+        if elapsed <= 0:
+            return 0.0
+        return self.count / elapsed
+
+    def report(self):
+        self.stream.write("%s: %d/%d files (%.1f files/sec)\n" %
+            (self.label, self.count, self.total, self.rate(),))
+
+    def tick(self, count = 1):
+        self.count += count
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def done(self):
+        self.report()
 
 
 def save_output(outfile, output):
-    fp = open(outfile, 'w')
-    fp.write(pformat(output, 0, 80))
+    records.write_records(outfile, output)
+
+
+def replace_output(outfile, output):
+    """
+    save_output() to a temporary file next to `outfile` which then replaces
+    it, so that being interrupted while writing never loses what `outfile`
+    held before.
+    """
+
+    (fd, tmpname) = tempfile.mkstemp(dir=os.path.dirname(outfile) or '.',
+                                     prefix='.reorg',
+                                     suffix=os.path.splitext(outfile)[1])
+    os.close(fd)
+    try:
+        save_output(tmpname, output)
+        if os.path.exists(outfile):
+            shutil.copymode(outfile, tmpname)
+        else:
+            # mkstemp() files are only readable by their owner
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmpname, 0666 & ~umask)
+        os.rename(tmpname, outfile)
+    except:
+        os.remove(tmpname)
+        raise
+
+
+def iter_input(filename):
+    return records.iter_records(filename)
 
 
 def read_input(filename):
-    return unrepr(open(filename).read())
+    return list(iter_input(filename))
+
+
+def collect_output(records, outfile = None):
+    records = list(records)
+    if outfile:
+        save_output(outfile, records)
+    return records
+
+
+def _echo_records(records):
+    for record in records:
+        pprint(record)
+        yield record
+
+
+def stream_output(records, outfile = None):
+    """
+    Print each record as it's produced and, if `outfile` is given, write it
+    out at the same time, without ever holding all of the records.
+    """
+    records = _echo_records(records)
+    if outfile:
+        save_output(outfile, records)
+    else:
+        for _ in records:
+            pass
+
+
+def is_dir_path(path):
+    """
+    Whether a path of a move is a directory: directory moves are written
+    with a trailing separator on both sides.
+    """
+    return path is not None and path.endswith(os.sep)
 
 
-def detect_moves(basenew = None, baseold = None, outfile = None):
-    moves = []
-    for (dirpath, dirnames, filenames,) in os.walk(baseold):
+def get_dir_signatures(base):
+    entries = [entry for entry in walk(base)
+               if not (GLOBAL_EXCLUDE and GLOBAL_EXCLUDE.search(entry[0]))]
+    fullpaths = [os.path.join(dirpath, filename)
+                 for (dirpath, dirnames, filenames,) in entries
+                 for filename in filenames]
+    hashes = dict(zip(fullpaths, get_file_hashes(fullpaths)))
+    return dirsig.get_signatures(entries, hashes.get)
+
+
+def detect_dir_moves(basenew, baseold):
+    """
+    The directories of `baseold` found, with all their content, somewhere
+    in `basenew`, as moves of (olddir, [(newdir, 1.0)]).
+    """
+
+    matches = dirsig.match_dirs(get_dir_signatures(baseold),
+                                get_dir_signatures(basenew), baseold, basenew)
+    return [(olddir + os.sep, [(newdir + os.sep, 1.0)])
+            for (olddir, newdir) in matches]
+
+
+def get_old_files(baseold):
+    oldfiles = []
+    for (dirpath, dirnames, filenames,) in walk(baseold):
         if GLOBAL_EXCLUDE and GLOBAL_EXCLUDE.search(dirpath):
             continue
         print dirpath
         for filename in filenames:
-            fp = os.path.join(dirpath, filename)
-            moves.append( (fp, detect_move(basenew, fp)) )
-    if outfile != None:
-        save_output(outfile, moves)
-    return moves
+            oldfiles.append(os.path.join(dirpath, filename))
+    return oldfiles
 
 
-def generate_ratios(infile, outfile = None):
+def get_stamp(filename):
+    st = os.stat(filename)
+    return (st.st_size, st.st_mtime)
+
+
+def get_move_key(basenew, oldfile):
+    """
+    Digest of everything the result of detect_move() for `oldfile` depends
+    on: the options, the old file and every candidate it is compared with in
+    `basenew` (the files are identified by size and mtime, like the scan
+    index does).  As long as the key is the same the previous result holds.
+    """
+
+    oldfilename = os.path.basename(oldfile)
+
+    candidates = set(os.path.join(dirpath, oldfilename)
+                     for dirpath in get_dirs_with_filename(basenew, oldfilename))
+    if FIND_RENAMES:
+        candidates.update(get_files_with_hash(basenew, get_file_hash(oldfile)))
+    if FIND_SIMILAR and is_text_mimetype(oldfile):
+        candidates.update(get_similar_files(basenew, read_file(oldfile)))
+    candidates = set(fullpath for fullpath in candidates if not is_claimed(fullpath))
+
+    options = (MIN_RATIO, SCORER, BEST_MATCH_ONLY, FIND_RENAMES, FIND_SIMILAR,
+               _classifier.mode,)
+    stamps = [(fullpath, get_stamp(fullpath)) for fullpath in sorted(candidates)]
+
+    return hashlib.sha1(repr((options, get_stamp(oldfile), stamps,))).hexdigest()
+
+
+def get_reusable_moves(previous, state, oldfiles, keys):
+    """
+    The moves of a previous findmoves output whose key, as saved in the
+    `state` file of that run, is still the same.
+    """
+
+    if not os.path.exists(state):
+        return {}
+
+    oldkeys = dict(iter_input(state))
+    current = dict(zip(oldfiles, keys))
+
+    reusable = {}
+    for (oldfile, matches) in iter_input(previous):
+        key = current.get(oldfile)
+        if key is not None and oldkeys.get(oldfile) == key:
+            reusable[oldfile] = matches
+    return reusable
+
+
+def _detect_move_job(args):
+    (basenew, oldfile) = args
+    return (oldfile, detect_move(basenew, oldfile))
+
+
+def detect_moves(basenew = None, baseold = None, outfile = None, jobs = 1,
+                 previous = None, state = None):
+    """
+    Find the moves of all the files of `baseold`.  When a `state` file is
+    given the key of every old file (see get_move_key) is saved to it, and
+    the moves of a `previous` run whose keys haven't changed are taken over
+    instead of being detected again.
+    """
+
+    global _claimed_dirs
+
+    oldfiles = get_old_files(baseold)
+
+    dirmoves = []
+    if FIND_DIRS:
+        dirmoves = detect_dir_moves(basenew, baseold)
+        moved = set(olddir.rstrip(os.sep) for (olddir, _) in dirmoves)
+        oldfiles = [fp for fp in oldfiles if not dirsig.is_inside(fp, moved)]
+        sys.stderr.write("findmoves: %d directories moved as a whole, %d files left\n" %
+            (len(dirmoves), len(oldfiles),))
+
+    # The new files inside the directories taken by those moves are off
+    # limits for the other old files
+    _claimed_dirs = set(newdir.rstrip(os.sep) for (_, [(newdir, _)]) in dirmoves)
+
+    try:
+        if FIND_SIMILAR:
+            # On `jobs` processes, before anything (the move keys too) needs it
+            get_similar_files(basenew, None, jobs)
+
+        keys = None
+        reusable = {}
+        if state:
+            keys = [get_move_key(basenew, fp) for fp in oldfiles]
+            if previous:
+                reusable = get_reusable_moves(previous, state, oldfiles, keys)
+                sys.stderr.write("findmoves: %d of %d files reused from '%s'\n" %
+                    (len(reusable), len(oldfiles), previous,))
+
+        jobargs = [(basenew, fp) for fp in oldfiles if fp not in reusable]
+
+        pool = None
+
+        if jobs > 1:
+            # Populate the filename and hash caches before forking so that each
+            # worker inherits them instead of re-walking --basenew on its own.
+            get_dirs_with_filename(basenew, None)
+            if FIND_RENAMES:
+                get_files_with_hash(basenew, None)
+            pool = multiprocessing.Pool(jobs)
+            # imap() hands results back in submission order, so the output is
+            # identical to the serial run no matter which worker finishes first.
+            chunksize = max(1, min(64, len(jobargs) / (jobs * 8)))
+            results = pool.imap(_detect_move_job, jobargs, chunksize)
+        else:
+            results = itertools.imap(_detect_move_job, jobargs)
+
+        moves = list(dirmoves)
+        progress = Progress("findmoves", len(jobargs))
+
+        try:
+            for oldfile in oldfiles:
+                if oldfile in reusable:
+                    moves.append((oldfile, reusable[oldfile]))
+                    continue
+                moves.append(next(results))
+                progress.tick()
+            if pool:
+                pool.close()
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        progress.done()
+
+        if outfile != None:
+            save_output(outfile, moves)
+        if state:
+            save_output(state, zip(oldfiles, keys))
+    finally:
+        _claimed_dirs = set()
+
+    return moves
 
-    ratios = []
-    moves = read_input(infile)
+
+def iter_ratios(moves):
 
     for (orig, dest) in moves:
 
@@ -225,22 +1041,28 @@ def generate_ratios(infile, outfile = None):
         if not dest:
             continue
 
+        if is_dir_path(orig):
+            # Directories are only matched when their content is identical
+            yield (orig, dest, 1.0)
+            continue
+
         if not (is_text_mimetype(orig) and is_text_mimetype(dest)):
             continue
 
-        ratio = get_ratio_of_files(orig, dest)
+        ratio = get_ratio_of_files(orig, dest, MIN_RATIO)
 
-        ratios.append((orig, dest, ratio))
+        if ratio is None:
+            continue
+
+        yield (orig, dest, ratio)
 
-    if outfile:
-        save_output(outfile, ratios)
 
-    return ratios
+def generate_ratios(infile, outfile = None):
+    return collect_output(iter_ratios(iter_input(infile)), outfile)
 
 
-def find_duplicate_targets(infile, outfile = None):
+def iter_duplicate_targets(moves):
 
-    moves = read_input(infile)
     targets = {}
 
     for move in moves:
@@ -257,26 +1079,114 @@ def find_duplicate_targets(infile, outfile = None):
         else:
             targets.setdefault(dest, []).append((orig,))
 
+    # Every move has to be seen before a target is known to be unique, this
+    # stage can only start yielding once its input is exhausted.
+    for (dest, origs) in targets.iteritems():
+        if len(origs) > 1:
+            yield (dest, origs)
 
-    for key in targets.keys():
-        if not len(targets[key]) > 1:
-            del targets[key]
 
-    targets = targets.items()
+def find_duplicate_targets(infile, outfile = None):
+    return collect_output(iter_duplicate_targets(iter_input(infile)), outfile)
 
-    if outfile != None:
-        save_output(outfile, targets)
 
-    return targets
+def iter_top_matches(moves):
 
+    for (filename, matches) in moves:
+        if matches:
+            yield (filename, matches[0][0])
+        else:
+            yield (filename, None)
 
-def pick_likely_moves(movesfile, outfile = None):
 
-    approved = []
-    moves = read_input(movesfile)
+def iter_assigned_moves(moves):
+    """
+    Resolve all of the moves at once: pick the one-to-one set of (old, new)
+    pairs with the highest total ratio, instead of going through 'pick' (or
+    'top'), 'duplicates', 'undupe' and 'unresolve'.  Old files that end up
+    without a match are left out, like deletes.
+    """
+
+    origs = []
+    edges = []
+    for (orig, matches) in moves:
+        origs.append(orig)
+        for (dest, ratio) in matches:
+            if ratio > 0 and (MIN_RATIO is None or ratio >= MIN_RATIO):
+                edges.append((orig, dest, ratio))
+
+    matching = assign.max_weight_matching(edges)
+
+    for orig in origs:
+        if orig in matching:
+            (dest, ratio) = matching[orig]
+            yield (orig, dest, ratio)
+
+
+def is_clear_pick(matches, threshold, margin = 0.0):
+    """
+    Whether the best of the (sorted) matches can be accepted without asking:
+    its ratio is at least `threshold` and at least `margin` ahead of the
+    runner-up.
+    """
+
+    if threshold is None or not matches:
+        return False
+
+    ratio = matches[0][1]
+    if ratio < threshold:
+        return False
+
+    if len(matches) > 1 and ratio - matches[1][1] < margin:
+        return False
+
+    return True
+
+
+def pick_moves(moves, approved = None, save = None):
+    """
+    Go through the moves, accepting the clear picks (see --auto-accept) right
+    away and asking about the rest.  Files already in `approved` are skipped,
+    and `save` is called with the picks so far after every answer, so that an
+    interrupted session can be resumed.  The picks are listed in the order of
+    `moves` however they were made.
+    """
+
+    if approved is None:
+        approved = []
+
+    picks = dict((pick[0], pick) for pick in approved)
+    filenames = []
+    ambiguous = []
+    automatic = 0
 
     for move in moves:
 
+        filename, matches = move
+        filenames.append(filename)
+        if filename in picks:
+            continue
+
+        if is_clear_pick(matches, AUTO_ACCEPT, AUTO_MARGIN):
+            picks[filename] = (filename, matches[0][0],)
+            automatic += 1
+        else:
+            ambiguous.append(move)
+
+    listed = set(filenames)
+    # Picks of files that aren't in `moves` anymore are kept at the end
+    unlisted = [pick for pick in approved if pick[0] not in listed]
+
+    def ordered():
+        return [picks[F] for F in filenames if F in picks] + unlisted
+
+    if AUTO_ACCEPT is not None:
+        print ">>> Auto-accepted %d files, %d left to pick" % (automatic, len(ambiguous),)
+        if save and automatic:
+            save(ordered())
+
+    for move in ambiguous:
+
         index = 0
 
         filename, matches = move
@@ -286,7 +1196,7 @@ def pick_likely_moves(movesfile, outfile = None):
 
             if not matches:
                 print ">>> No potential matches for: %s" % (filename,)
-                approved.append((filename, None,))
+                picks[filename] = (filename, None,)
                 break
 
             match = matches[index]
@@ -299,11 +1209,14 @@ def pick_likely_moves(movesfile, outfile = None):
 
             try:
                 inp = raw_input()
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, EOFError):
+                if save:
+                    save(ordered())
+                    print "\n>>> Stopped, %d picks saved, resume with --resume" % (len(picks),)
                 return
 
             if   inp == 'a':
-                approved.append( (filename, potential,) )
+                picks[filename] = (filename, potential,)
                 break
             elif inp == 'r':
                 matches.pop(index)
@@ -312,7 +1225,8 @@ def pick_likely_moves(movesfile, outfile = None):
                     break
                 index = (index) % len(matches)
             elif inp == 'd':
-                subprocess.call(["meld", filename, potential])
+                # Don't wait for the diff viewer, keep picking while it's open
+                subprocess.Popen(["meld", filename, potential])
                 continue
             elif inp == 'n':
                 index = (index + 1) % len(matches)
@@ -324,16 +1238,38 @@ def pick_likely_moves(movesfile, outfile = None):
             else:
                 print ">>> Invalid selection!"
 
+        if save:
+            save(ordered())
+
+    return ordered()
+
+
+def pick_likely_moves(movesfile, outfile = None, resume = False):
+
+    approved = []
+    if resume and outfile and os.path.exists(outfile):
+        approved = read_input(outfile)
+
+    save = None
     if outfile:
-        save_output(outfile, approved)
+        save = lambda picks: replace_output(outfile, picks)
+
+    approved = pick_moves(iter_input(movesfile), approved, save)
+
+    if approved is None:
+        return
+
+    if outfile:
+        replace_output(outfile, approved)
 
     return approved
 
 
-def filter_picks(infile, outfile = None):
+def iter_filtered_picks(moves, include = None, exclude = None):
 
-    filtered = []
-    moves = read_input(infile)
+    if include is None and exclude is None:
+        include = GLOBAL_INCLUDE
+        exclude = GLOBAL_EXCLUDE
 
     for move in moves:
 
@@ -345,48 +1281,46 @@ def filter_picks(infile, outfile = None):
         if len(move) > 2:
             ratio = move[2]
 
-        include = None
+        included = None
 
-        if GLOBAL_INCLUDE:
+        if include:
 
-            include = False 
+            included = False 
 
-            if GLOBAL_INCLUDE.search(orig):
-                include = True
-            if dest and GLOBAL_INCLUDE.search(dest):
-                include = True
-            #if ratio and GLOBAL_INCLUDE.search(ratio):
-            #    include = True
+            if include.search(orig):
+                included = True
+            if dest and include.search(dest):
+                included = True
+            #if ratio and include.search(ratio):
+            #    included = True
 
-        if GLOBAL_EXCLUDE:
+        if exclude:
 
-            include = True
+            included = True
             
-            if GLOBAL_EXCLUDE.search(orig):
-                include = False
-            if dest and GLOBAL_EXCLUDE.search(dest):
-                include = False
-            #if ratio and GLOBAL_EXCLUDE.search(ratio):
-            #    include = False
+            if exclude.search(orig):
+                included = False
+            if dest and exclude.search(dest):
+                included = False
+            #if ratio and exclude.search(ratio):
+            #    included = False
 
         item = (orig, dest)
         if ratio:
             item = (orig, dest, ratio)
 
-        if include:
-            filtered.append(item)
-
         print "%s -> %s" % (orig, dest)
 
-    if outfile:
-        save_output(outfile, filtered)
+        if included:
+            yield item
 
-    return filtered
 
+def filter_picks(infile, outfile = None):
+    return collect_output(iter_filtered_picks(iter_input(infile)), outfile)
 
-def average_ratios(infile):
 
-    moves = read_input(infile)
+def get_average_ratio(moves):
+
     ratio_sum = 0
     count = 0
     for (_, _, ratio) in moves:
@@ -395,27 +1329,23 @@ def average_ratios(infile):
     return ratio_sum / count
 
 
-def pick_top_of_dupes(infile, outfile = None):
+def average_ratios(infile):
+    return get_average_ratio(iter_input(infile))
+
 
-    dupes = read_input(infile)
-    picks = []
+def iter_top_of_dupes(dupes):
 
     for (dest, origs) in dupes:
 
         origs.sort(cmp = lambda x,y: -cmp(x[1], y[1]))
-        picks.append((origs[0][0], dest, origs[0][1],))
+        yield (origs[0][0], dest, origs[0][1],)
 
-    if outfile:
-        save_output(outfile, picks) 
-
-    return picks
 
+def pick_top_of_dupes(infile, outfile = None):
+    return collect_output(iter_top_of_dupes(iter_input(infile)), outfile)
 
-def remove_unresolved_pick(infile, additional, outfile = None):
 
-    filtered = []
-    moves = read_input(infile)
-    resolved = read_input(additional)
+def iter_resolved_picks(moves, resolved):
 
     resolved_dict = {}
     for resolve in resolved:
@@ -443,44 +1373,52 @@ def remove_unresolved_pick(infile, additional, outfile = None):
         if ratio:
             item = (orig, dest, ratio)
 
-        filtered.append(item)
+        yield item
 
-    if outfile:
-        save_output(outfile, filtered)
 
-    return filtered
+def remove_unresolved_pick(infile, additional, outfile = None):
+    return collect_output(
+        iter_resolved_picks(iter_input(infile), iter_input(additional)), outfile)
 
 
-def merge_adds_and_deletes(infile, baseold, basenew, outfile = None):
+def add_adds_and_deletes(moves, baseold, basenew):
 
     withaddsdels = []
-    moves = read_input(infile)
+    moves = list(moves)
 
     orig_set = set() 
     dest_set = set() 
 
+    # The files inside moved directories are accounted for by them
+    orig_dirs = set()
+    dest_dirs = set()
+
     for move in moves:
         orig = move[0]
         orig_set.add(orig)
         dest = move[1]
         dest_set.add(dest)
+        if is_dir_path(orig):
+            orig_dirs.add(orig.rstrip(os.sep))
+        if is_dir_path(dest):
+            dest_dirs.add(dest.rstrip(os.sep))
 
-    for (dirpath, dirnames, filenames,) in os.walk(baseold):
+    for (dirpath, dirnames, filenames,) in walk(baseold):
         for filename in filenames:
             fp = os.path.join(dirpath, filename)
             if GLOBAL_EXCLUDE and GLOBAL_EXCLUDE.search(fp):
                 continue
-            if fp not in orig_set:
+            if fp not in orig_set and not dirsig.is_inside(fp, orig_dirs):
                 withaddsdels.append((fp, None, -1))
 
     withaddsdels = []
 
-    for (dirpath, dirnames, filenames,) in os.walk(basenew):
+    for (dirpath, dirnames, filenames,) in walk(basenew):
         for filename in filenames:
             fp = os.path.join(dirpath, filename)
             if GLOBAL_EXCLUDE and GLOBAL_EXCLUDE.search(fp):
                 continue
-            if fp not in dest_set:
+            if fp not in dest_set and not dirsig.is_inside(fp, dest_dirs):
                 withaddsdels.append((None, fp, -1))
 
 
@@ -502,39 +1440,167 @@ def merge_adds_and_deletes(infile, baseold, basenew, outfile = None):
     moves.sort(cmp=insortadds())
     moves.sort(cmp=insortdels())
 
+    return moves
+
+
+def merge_adds_and_deletes(infile, baseold, basenew, outfile = None):
+
+    moves = add_adds_and_deletes(iter_input(infile), baseold, basenew)
+
     if outfile:
         save_output(outfile, moves)
 
     return moves
 
 
-def generate_diffs(infile):
+_newline_regex = re.compile('\r\n|\n|\r')
 
-    moves = read_input(infile)
+# Moves handed to the diff workers at a time, so that at most that many
+# diffs wait in memory to be written out
+DIFF_WINDOW = 256
 
-    for move in moves:
 
-        orig = move[0]
-        dest = move[1]
+def get_diff(move):
+    """
+    The unified diff of a move, None if either file isn't text.  Identical
+    files are recognized by their hashes and never split or diffed.
+    """
 
-        regex = re.compile('\r\n|\n|\r')
+    orig = move[0]
+    dest = move[1]
 
-        if orig != None and not is_text_mimetype(orig):
-            continue
+    if is_dir_path(orig) or is_dir_path(dest):
+        return ''
 
-        if dest != None and not is_text_mimetype(dest):
-            continue
+    if orig != None and not is_text_mimetype(orig):
+        return None
+
+    if dest != None and not is_text_mimetype(dest):
+        return None
+
+    if orig != None and dest != None:
+        if get_file_hash(orig) == get_file_hash(dest):
+            return ''
+
+    orig_data = []
+    if orig != None:
+        orig_data = _newline_regex.split(read_file(orig))
+
+    dest_data = []
+    if dest != None:
+        dest_data = _newline_regex.split(read_file(dest))
+
+    diff = difflib.unified_diff([S.rstrip() + '\n' for S in orig_data], [S.rstrip() + '\n' for S in dest_data], orig, dest)
+    return ''.join(diff)
+
+
+def iter_diffs(moves, jobs = 1):
+    """
+    (move, diff) for each of `moves` in their order, the diffs being computed
+    by `jobs` processes a window of moves at a time.
+    """
+
+    if jobs <= 1:
+        for move in moves:
+            yield (move, get_diff(move))
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    moves = iter(moves)
+
+    try:
+        while True:
+            window = list(itertools.islice(moves, DIFF_WINDOW))
+            if not window:
+                break
+            for item in itertools.izip(window, pool.imap(get_diff, window)):
+                yield item
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+BUNDLE_INDEX = "index.jsonl"
+
+
+def count_changes(diff):
+    """
+    The number of added and removed lines of a unified diff.
+    """
+
+    added = 0
+    removed = 0
+    # Past the '---' and '+++' headers every line starts with its kind
+    for line in diff.split('\n')[2:]:
+        if line.startswith('+'):
+            added += 1
+        elif line.startswith('-'):
+            removed += 1
+    return (added, removed)
+
+
+def print_diffs(moves, outfile = None, jobs = 1, bundle = None):
+    """
+    Write the diffs of `moves` to `outfile` (stdout by default).  With a
+    `bundle` directory every diff is also written to a patch file of its
+    own in there, listed in the BUNDLE_INDEX file by records of:
+
+        (orig, dest, ratio, added, removed, patch, offset, size)
+
+    `ratio` is the one of the move if it has one, `patch` the name of the
+    patch file in the bundle and `offset` and `size` the position of the
+    diff in `outfile`.  Written to stdout the diffs can be mixed with other
+    output, so there `offset` is None.  Moves that have no diff (binary
+    files) are listed with None for all of those.
+    """
+
+    stream = sys.stdout
+    if outfile:
+        stream = open(outfile, 'w')
+
+    if bundle and not os.path.isdir(bundle):
+        os.makedirs(bundle)
+
+    index = []
+    offset = 0
+
+    try:
+        for (number, (move, diff)) in enumerate(iter_diffs(moves, jobs)):
+
+            if diff is not None:
+                stream.write(diff + '\n')
+
+            if not bundle:
+                continue
+
+            ratio = None
+            if len(move) > 2:
+                ratio = move[2]
+
+            if diff is None:
+                index.append((move[0], move[1], ratio, None, None, None, None, None))
+                continue
 
-        orig_data = []
-        if orig != None:
-            orig_data = regex.split(open(orig).read())
+            patch = "%06d.patch" % (number,)
+            with open(os.path.join(bundle, patch), 'w') as fp:
+                fp.write(diff)
 
-        dest_data = []
-        if dest != None:
-            dest_data = regex.split(open(dest).read())
+            (added, removed) = count_changes(diff)
+            index.append((move[0], move[1], ratio, added, removed, patch,
+                          offset if outfile else None, len(diff)))
 
-        diff = difflib.unified_diff([S.rstrip() + '\n' for S in orig_data], [S.rstrip() + '\n' for S in dest_data], orig, dest) 
-        print ''.join(diff)
+            offset += len(diff) + 1
+    finally:
+        if outfile:
+            stream.close()
+
+    if bundle:
+        save_output(os.path.join(bundle, BUNDLE_INDEX), index)
+
+
+def generate_diffs(infile, outfile = None, jobs = 1, bundle = None):
+    print_diffs(iter_input(infile), outfile, jobs, bundle)
 
 
 COMMAND_RENAME = "rename"
@@ -550,6 +1616,10 @@ COMMAND_UNDUPE = "undupe"
 COMMAND_UNRESOLVE = "unresolve"
 COMMAND_DIFF = "diff"
 COMMAND_WITHADDSDELS = "w_addsdels"
+COMMAND_CHAIN = "chain"
+COMMAND_TOP = "top"
+COMMAND_PIPELINE = "pipeline"
+COMMAND_ASSIGN = "assign"
 
 COMMANDS = [
     COMMAND_RENAME,
@@ -565,9 +1635,249 @@ COMMANDS = [
     COMMAND_UNRESOLVE,
     COMMAND_DIFF,
     COMMAND_WITHADDSDELS,
+    COMMAND_CHAIN,
+    COMMAND_TOP,
+    COMMAND_PIPELINE,
+    COMMAND_ASSIGN,
 ]
 
 
+def _stage_top(records, config):
+    return iter_top_matches(records)
+
+def _stage_assign(records, config):
+    return iter_assigned_moves(records)
+
+def _stage_ratio(records, config):
+    return iter_ratios(records)
+
+def _stage_filter(records, config):
+    return iter_filtered_picks(records)
+
+def _stage_duplicates(records, config):
+    return iter_duplicate_targets(records)
+
+def _stage_undupe(records, config):
+    return iter_top_of_dupes(records)
+
+def _stage_unresolve(records, config):
+    return iter_resolved_picks(records, iter_input(config.infile2))
+
+STREAM_STAGES = {
+    COMMAND_TOP: _stage_top,
+    COMMAND_ASSIGN: _stage_assign,
+    COMMAND_RATIO: _stage_ratio,
+    COMMAND_FILTER_PICKS: _stage_filter,
+    COMMAND_DUPLICATES: _stage_duplicates,
+    COMMAND_UNDUPE: _stage_undupe,
+    COMMAND_UNRESOLVE: _stage_unresolve,
+}
+
+
+def chain_stages(records, stages, config):
+    """
+    Connect the named streaming stages so that each one consumes the records
+    of the one before it, nothing is written out between stages.
+    """
+    for stage in stages:
+        records = STREAM_STAGES[stage](records, config)
+    return records
+
+
+def _pipeline_findmoves(records, options, state):
+    config = state['config']
+    return detect_moves(basenew = options.get('basenew', config.basenew),
+                        baseold = options.get('baseold', config.baseold),
+                        jobs = options.get('jobs', config.jobs),
+                        previous = options.get('previous', config.previous),
+                        state = options.get('state', config.state))
+
+def _pipeline_pick(records, options, state):
+    return pick_moves(records)
+
+def _pipeline_filter(records, options, state):
+    include = options.get('include')
+    exclude = options.get('exclude')
+    if include is not None:
+        include = re.compile(include)
+    if exclude is not None:
+        exclude = re.compile(exclude)
+    return list(iter_filtered_picks(records, include, exclude))
+
+def _pipeline_average(records, options, state):
+    pprint(get_average_ratio(records))
+    return records
+
+def _pipeline_duplicates(records, options, state):
+    # 'unresolve' needs the picks that went into the duplicates pass
+    state['picks'] = records
+    return list(iter_duplicate_targets(records))
+
+def _pipeline_unresolve(records, options, state):
+    return list(iter_resolved_picks(state['picks'], records))
+
+def _pipeline_diff(records, options, state):
+    config = state['config']
+    print_diffs(records, outfile = options.get('diff_outfile'),
+                jobs = options.get('jobs', config.jobs),
+                bundle = options.get('bundle', config.bundle))
+    return records
+
+def _pipeline_addsdels(records, options, state):
+    config = state['config']
+    return add_adds_and_deletes(records,
+                                options.get('baseold', config.baseold),
+                                options.get('basenew', config.basenew))
+
+def _pipeline_stream(stage):
+    def func(records, options, state):
+        return list(STREAM_STAGES[stage](records, state['config']))
+    return func
+
+PIPELINE_STAGES = {
+    COMMAND_FINDMOVES: _pipeline_findmoves,
+    COMMAND_PICK: _pipeline_pick,
+    COMMAND_TOP: _pipeline_stream(COMMAND_TOP),
+    COMMAND_ASSIGN: _pipeline_stream(COMMAND_ASSIGN),
+    COMMAND_RATIO: _pipeline_stream(COMMAND_RATIO),
+    COMMAND_FILTER_PICKS: _pipeline_filter,
+    COMMAND_AVERAGE: _pipeline_average,
+    COMMAND_DUPLICATES: _pipeline_duplicates,
+    COMMAND_UNDUPE: _pipeline_stream(COMMAND_UNDUPE),
+    COMMAND_UNRESOLVE: _pipeline_unresolve,
+    COMMAND_DIFF: _pipeline_diff,
+    COMMAND_WITHADDSDELS: _pipeline_addsdels,
+}
+
+
+def read_pipeline_spec(filename):
+    """
+    A pipeline spec is a list of stages, each either a command name or a
+    (command name, {option: value}) pair, e.g.:
+
+        [('findmoves', {'basenew': 'NewThing', 'baseold': 'OldThing'}),
+         'top',
+         'ratio',
+         ('filter', {'exclude': '_v11', 'outfile': 'picks.txt'}),
+         'duplicates',
+         'undupe',
+         'unresolve',
+         'diff']
+
+    Stages take their inputs from the command line unless overridden by an
+    option, and 'outfile' saves the records a stage produced.  The 'diff'
+    stage writes the diffs to its 'diff_outfile' option, stdout otherwise.
+    """
+    spec = []
+    for entry in iter_input(filename):
+        if isinstance(entry, basestring):
+            spec.append((entry, {}))
+        else:
+            (stage, options) = entry
+            spec.append((stage, dict(options)))
+    return spec
+
+
+# The inputs a stage can't run without, from its options or the command line
+PIPELINE_INPUTS = {
+    COMMAND_FINDMOVES: ['basenew', 'baseold'],
+    COMMAND_WITHADDSDELS: ['basenew', 'baseold'],
+}
+
+
+def check_pipeline_spec(spec, config):
+    have_picks = False
+    for (stage, options) in spec:
+        if stage not in PIPELINE_STAGES:
+            return "Unknown stage '%s', choose from: %s" % (
+                stage, ', '.join(sorted(PIPELINE_STAGES)),)
+        for name in PIPELINE_INPUTS.get(stage, []):
+            if not options.get(name, getattr(config, name)):
+                return "Stage '%s' requires --%s (or a '%s' option)" % (
+                    stage, name, name,)
+        if stage == COMMAND_DUPLICATES:
+            have_picks = True
+        if stage == COMMAND_UNRESOLVE and not have_picks:
+            return "Stage 'unresolve' must come after a 'duplicates' stage"
+    return None
+
+
+def run_pipeline(spec, config, records = None):
+    """
+    Run every stage of `spec` in turn on the records the previous stage
+    produced, keeping them in memory, and report how long each stage took.
+    """
+
+    if records is None:
+        records = []
+
+    state = {'config': config}
+    started = time.time()
+
+    for (stage, options) in spec:
+
+        start = time.time()
+        records = PIPELINE_STAGES[stage](records, options, state)
+
+        if records is None:
+            sys.stderr.write("pipeline: stopped during '%s'\n" % (stage,))
+            return None
+
+        if 'outfile' in options:
+            save_output(options['outfile'], records)
+
+        sys.stderr.write("pipeline: %-10s %8d records %8.2fs\n" %
+            (stage, len(records), time.time() - start,))
+
+    sys.stderr.write("pipeline: %-10s %8s         %8.2fs\n" %
+        ('total', '', time.time() - started,))
+
+    return records
+
+
+# The hot paths timed by --stats: (function, reported as, returns an
+# iterator, measure of the data processed, unit of that measure)
+INSTRUMENTED = [
+    ("walk", "walk", True, lambda entry: len(entry[2]), "files"),
+    ("get_mimetype", "mimetype", False, None, None),
+    ("is_text_mimetype", "classify", False, None, None),
+    ("read_file", "read", False, len, "bytes"),
+    ("get_file_hash", "hash", False, None, None),
+    ("get_ratio", "score", False, None, None),
+    ("get_char_ratio", "score:chars", False, None, None),
+    ("get_line_ratio", "score:lines", False, None, None),
+    ]
+
+_stats = None
+_uninstrumented = {}
+
+
+def set_stats(collector):
+    """
+    Replace the functions of INSTRUMENTED by versions counting and timing
+    their calls in `collector`, or put the originals back if it is None.
+    """
+
+    global _stats
+
+    module = globals()
+
+    if collector is None:
+        if _stats is not None:
+            module.update(_uninstrumented)
+        _stats = None
+        return
+
+    for (name, label, iterates, measure, unit) in INSTRUMENTED:
+        func = _uninstrumented.setdefault(name, module[name])
+        if iterates:
+            module[name] = collector.wrap_iter(label, func, measure, unit)
+        else:
+            module[name] = collector.wrap(label, func, measure, unit)
+
+    _stats = collector
+
+
 def parse_arguments(args=sys.argv[1:]):
 
     parser = argparse.ArgumentParser(
@@ -577,6 +1887,8 @@ def parse_arguments(args=sys.argv[1:]):
 
             - 'rename'    : rename all the directories, files, and then contents according
                             to the specified renames (added with --addrename)
+                            the whole plan is computed first, so --pretend lists exactly
+                            what would change (see --plan)
 
             - 'unique'    : attempt to determine how unique the file names are in the 
                             current directory
@@ -616,6 +1928,23 @@ def parse_arguments(args=sys.argv[1:]):
 
             - 'w_addsdels': put adds and deletes back in to the list of files so that a
                             'diff' command will display them
+
+            - 'top'       : for a given set of moves (--infile), pick the best scoring
+                            match of each file without asking
+
+            - 'pipeline'  : run a whole workflow in one go, from a spec file (--spec, see
+                            read_pipeline_spec) or a list of commands (--stages), for
+                            example --stages findmoves,top,ratio,duplicates,undupe,
+                            unresolve,diff
+
+            - 'assign'    : for a given set of moves (--infile), pick the one-to-one
+                            set of moves with the highest total ratio, this replaces
+                            the 'pick', 'duplicates', 'undupe' and 'unresolve' rounds
+
+            - 'chain'     : run several of the 'top', 'assign', 'ratio', 'filter',
+                            'duplicates', 'undupe' and 'unresolve' commands (--stages)
+                            one after the other on the records of --infile, without
+                            intermediate files
                            
         """)
     )
@@ -633,7 +1962,46 @@ def parse_arguments(args=sys.argv[1:]):
     parser.add_argument("--baseold", help="base of the old collection of files")
     parser.add_argument("--infile", help="input file for certain commands (pick, filter, ratio, average, duplicates, undupe, unresolve)")
     parser.add_argument("--infile2", help="additional input file for certain commands (unresolve)")
-    parser.add_argument("--outfile", help="output file to save the results of certain commands (findmoves, pick, filter, ratio, filter, duplicates, undupe, unresolve)")
+    parser.add_argument("--outfile", help="output file to save the results of certain commands (findmoves, pick, filter, ratio, filter, duplicates, undupe, unresolve, diff)")
+
+    parser.add_argument("--scorer", choices=SCORERS, default=SCORER_CHARS, help="compare files character by character, line by line, or line by line only when the old file is big (findmove, findmoves, ratio)")
+    parser.add_argument("--min-ratio", type=float, help="skip matches whose similarity ratio is below this value (findmove, findmoves, ratio)")
+    parser.add_argument("--best-only", action="store_true", help="only keep the best scoring match for each file (findmove, findmoves)")
+
+    parser.add_argument("--find-renames", action="store_true", help="also report identical files that were renamed as matches (findmove, findmoves)")
+
+    parser.add_argument("--find-similar", action="store_true", help="also consider files with a different name whose content is similar, found through MinHash signatures (findmove, findmoves)")
+    parser.add_argument("--find-dirs", action="store_true", help="first find the directories that moved with all their content, written as a single move ending with a path separator, and only match the remaining files one by one (findmoves)")
+    parser.add_argument("--indexdir", help="directory holding persistent scan indexes of the base directories, reused across commands and runs (unique, findmove, findmoves, w_addsdels)")
+
+    parser.add_argument("--classify", choices=classify.MODES, default=classify.MODE_MAGIC, help="how to tell text files from binary ones: always ask libmagic, or go by extension and content first and only ask libmagic when unsure")
+
+    parser.add_argument("--read-cache", type=int, default=contents.DEFAULT_CACHE_SIZE / (1024 * 1024), help="megabytes of file contents to keep in memory for reuse")
+
+    parser.add_argument("--name-cache", type=int, default=namecache.DEFAULT_MAX_BYTES / (1024 * 1024), help="megabytes of file name listings of the base directories to keep in memory (the last one scanned is always kept)")
+
+    parser.add_argument("--scan-threads", type=int, default=0, help="number of directory listings and file hashes to keep in flight at once, for trees on high latency (network) filesystems")
+
+    parser.add_argument("--ratio-cache", help="SQLite file keeping the ratios of the pairs already scored, reused across commands and runs")
+
+    parser.add_argument("--stats", action="store_true", help="count and time the walks, classifications, reads, hashes and scorings, and print a summary at exit (of the main process only, with --jobs)")
+    parser.add_argument("--profile", help="file to write the cProfile statistics of the command to")
+
+    parser.add_argument("--auto-accept", type=float, help="accept the best match without asking when its ratio is at least this (pick)")
+    parser.add_argument("--auto-margin", type=float, default=0.1, help="how far ahead of the runner-up an automatically accepted match has to be (pick)")
+    parser.add_argument("--resume", action="store_true", help="keep the picks already in --outfile and only go through the files not picked yet (pick), or finish the steps of --plan not done yet (rename)")
+
+    parser.add_argument("--jobs", type=int, default=1, help="number of worker processes to use for certain commands (findmoves, rename, diff)")
+
+    parser.add_argument("--previous", help="moves output of an earlier run to take the unchanged files over from, needs --state (findmoves)")
+    parser.add_argument("--state", help="file keeping what each move was computed from, read for --previous and rewritten (findmoves)")
+
+    parser.add_argument("--bundle", help="directory to also write every diff to as a patch file of its own, with an index of them (diff)")
+
+    parser.add_argument("--plan", help="file to save the planned renames and content rewrites to (rename)")
+
+    parser.add_argument("--stages", help="comma separated list of commands to run one after the other (chain, pipeline)")
+    parser.add_argument("--spec", help="file describing the stages of a pipeline and their options (pipeline)")
 
     parser.add_argument("--cmd", choices=COMMANDS, help="perform a command, see above for descriptions")
 
@@ -649,6 +2017,9 @@ def parse_arguments(args=sys.argv[1:]):
         COMMAND_UNRESOLVE,
         COMMAND_DIFF,
         COMMAND_WITHADDSDELS,
+        COMMAND_CHAIN,
+        COMMAND_TOP,
+        COMMAND_ASSIGN,
         ])
 
     requires_baseold = set([
@@ -667,6 +2038,9 @@ def parse_arguments(args=sys.argv[1:]):
         if not namespace.oldfile:
             parser.error("Command requires --oldfile")
 
+    if namespace.previous and not namespace.state:
+        parser.error("--previous requires --state")
+
     if namespace.cmd in requires_basenew:
         if not namespace.basenew:
             parser.error("Command requires --basenew")
@@ -683,11 +2057,94 @@ def parse_arguments(args=sys.argv[1:]):
         if not namespace.infile2:
             parser.error("Command requires --infile2=<INFILE2>")
 
+    if namespace.cmd == COMMAND_CHAIN:
+        if not namespace.stages:
+            parser.error("Command requires --stages=<STAGE,STAGE,...>")
+        namespace.stages = namespace.stages.split(',')
+        for stage in namespace.stages:
+            if stage not in STREAM_STAGES:
+                parser.error("Unknown stage '%s', choose from: %s" %
+                    (stage, ', '.join(sorted(STREAM_STAGES)),))
+        if COMMAND_UNRESOLVE in namespace.stages and not namespace.infile2:
+            parser.error("Stage 'unresolve' requires --infile2=<INFILE2>")
+
+    if namespace.cmd == COMMAND_PIPELINE:
+        if namespace.spec:
+            namespace.spec = read_pipeline_spec(namespace.spec)
+        elif namespace.stages:
+            namespace.spec = [(stage, {}) for stage in namespace.stages.split(',')]
+        else:
+            parser.error("Command requires --spec=<SPEC> or --stages=<STAGE,STAGE,...>")
+        message = check_pipeline_spec(namespace.spec, namespace)
+        if message:
+            parser.error(message)
+
+    if namespace.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    if namespace.scan_threads < 0:
+        parser.error("--scan-threads can't be negative")
+
     global PRETEND_OPS
 
     if namespace.pretend:
         PRETEND_OPS = True
 
+    global SCORER
+
+    SCORER = namespace.scorer
+
+    global MIN_RATIO, BEST_MATCH_ONLY, FIND_RENAMES
+
+    MIN_RATIO = namespace.min_ratio
+    BEST_MATCH_ONLY = namespace.best_only
+    FIND_RENAMES = namespace.find_renames
+
+    global FIND_SIMILAR, FIND_DIRS
+
+    FIND_SIMILAR = namespace.find_similar
+    FIND_DIRS = namespace.find_dirs
+
+    global AUTO_ACCEPT, AUTO_MARGIN
+
+    AUTO_ACCEPT = namespace.auto_accept
+    AUTO_MARGIN = namespace.auto_margin
+
+    global INDEX_DIR
+
+    INDEX_DIR = namespace.indexdir
+
+    # Before the caches below get hold of walk and get_mimetype
+    set_stats(stats.Stats() if namespace.stats else None)
+
+    global _classifier
+
+    _classifier = classify.Classifier(get_mimetype, namespace.classify)
+
+    global _contents
+
+    _contents = contents.ContentCache(namespace.read_cache * 1024 * 1024)
+
+    global _names_cache
+
+    _names_cache = namecache.NameCache(walk, namespace.name_cache * 1024 * 1024)
+
+    global _scanner
+
+    if _scanner is not None:
+        _scanner.close()
+    _scanner = None
+    if namespace.scan_threads:
+        _scanner = scanner.Scanner(namespace.scan_threads)
+
+    global _ratio_cache
+
+    if _ratio_cache is not None:
+        _ratio_cache.close()
+    _ratio_cache = None
+    if namespace.ratio_cache:
+        _ratio_cache = ratiocache.RatioCache(namespace.ratio_cache)
+
     global _rename_target
 
     if namespace.rename_target:
@@ -708,14 +2165,12 @@ def parse_arguments(args=sys.argv[1:]):
     return namespace
 
 
-def main():
-
-    config = parse_arguments()
+def run_command(config):
 
     if config.cmd == COMMAND_RENAME:
 
-        rename_dirs()
-        rename_files()
+        rename_tree(planfile = config.plan, resume = config.resume,
+                    jobs = config.jobs)
 
     elif config.cmd == COMMAND_UNIQUE:
         are_file_names_unique()
@@ -727,44 +2182,78 @@ def main():
     elif config.cmd == COMMAND_FINDMOVES:
         moves = detect_moves(basenew = config.basenew,
                              baseold = config.baseold,
-                             outfile = config.outfile)
+                             outfile = config.outfile,
+                             jobs = config.jobs,
+                             previous = config.previous,
+                             state = config.state)
         pprint(moves)
 
     elif config.cmd == COMMAND_PICK:
-        picks = pick_likely_moves(config.infile, outfile = config.outfile)
+        picks = pick_likely_moves(config.infile, outfile = config.outfile,
+                                  resume = config.resume)
         pprint(picks)
 
-    elif config.cmd == COMMAND_RATIO:
-        ratios = generate_ratios(config.infile, outfile = config.outfile)
-        pprint(ratios)
+    elif config.cmd in STREAM_STAGES:
+        records = chain_stages(iter_input(config.infile), [config.cmd], config)
+        stream_output(records, outfile = config.outfile)
+
+    elif config.cmd == COMMAND_CHAIN:
+        records = chain_stages(iter_input(config.infile), config.stages, config)
+        stream_output(records, outfile = config.outfile)
 
-    elif config.cmd == COMMAND_FILTER_PICKS:
-        filtered = filter_picks(config.infile, outfile = config.outfile)
-        pprint(filtered)
+    elif config.cmd == COMMAND_PIPELINE:
+        records = None
+        if config.infile:
+            records = read_input(config.infile)
+        records = run_pipeline(config.spec, config, records)
+        if records is not None and config.outfile:
+            save_output(config.outfile, records)
 
     elif config.cmd == COMMAND_AVERAGE:
         average = average_ratios(config.infile)
         pprint(average)
 
-    elif config.cmd == COMMAND_DUPLICATES:
-        dupes = find_duplicate_targets(config.infile, outfile= config.outfile)
-        pprint(dupes)
-
-    elif config.cmd == COMMAND_UNDUPE:
-        undupe = pick_top_of_dupes(config.infile, outfile=config.outfile)
-        pprint(undupe)
-
-    elif config.cmd == COMMAND_UNRESOLVE:
-        filtered = remove_unresolved_pick(config.infile, config.infile2, outfile=config.outfile)
-        pprint(filtered)
-
     elif config.cmd == COMMAND_DIFF:
-        generate_diffs(config.infile)
+        generate_diffs(config.infile, outfile = config.outfile, jobs = config.jobs,
+                       bundle = config.bundle)
 
     elif config.cmd == COMMAND_WITHADDSDELS:
         moves = merge_adds_and_deletes(config.infile, config.baseold, config.basenew, outfile=config.outfile)
         pprint(moves)
 
 
+def main():
+
+    config = parse_arguments()
+
+    profiler = None
+    if config.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        run_command(config)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(config.profile)
+            sys.stderr.write("profile: written to '%s'\n" % (config.profile,))
+
+    save_scan_indexes()
+
+    if _stats is not None:
+        sys.stderr.write(_stats.report() + "\n")
+
+    if _ratio_cache is not None:
+        _ratio_cache.close()
+        sys.stderr.write(_ratio_cache.report() + "\n")
+
+    if _classifier.lookups:
+        sys.stderr.write(_classifier.report() + "\n")
+
+    if _names_cache.hits or _names_cache.misses:
+        sys.stderr.write(_names_cache.report() + "\n")
+
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
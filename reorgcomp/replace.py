@@ -0,0 +1,148 @@
+# File: replace.py
+
+import re
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def overlap(x, y):
+    """
+    Whether an occurrence of `x` and an occurrence of `y` can share some
+    characters in a string (or touch, for an empty string).
+    """
+    if x in y or y in x:
+        return True
+    for size in xrange(1, min(len(x), len(y))):
+        if x.endswith(y[:size]) or y.endswith(x[:size]):
+            return True
+    return False
+
+
+def is_single_pass_safe(renames):
+    """
+    Whether replacing every rename in one left to right pass gives the same
+    result as applying them one after the other with str.replace().  That
+    holds when no two patterns can overlap (so their matches don't compete)
+    and no replacement can form, alone or with its surroundings, the pattern
+    of a later rename (which the sequential replace would then rewrite).
+    """
+
+    froms = [from_ for (from_, _) in renames]
+
+    if '' in froms or len(set(froms)) != len(froms):
+        return False
+
+    for (i, (from_i, to_i)) in enumerate(renames):
+        for (j, (from_j, _)) in enumerate(renames):
+            if i == j:
+                continue
+            if overlap(from_i, from_j):
+                return False
+            if j > i and overlap(to_i, from_j):
+                return False
+
+    return True
+
+
+class MultiReplacer(object):
+    """
+    Applies a list of (from, to) renames the way successive str.replace()
+    calls would, but finds all of the patterns with a single compiled regex:
+    strings without any pattern are recognized in one scan, and when the
+    renames don't interact (see is_single_pass_safe) they are all replaced
+    in that same pass.
+    """
+
+    def __init__(self, renames):
+        self.renames = list(renames)
+        self.table = dict(self.renames)
+        self.single_pass = is_single_pass_safe(self.renames)
+        patterns = sorted(set(from_ for (from_, _) in self.renames if from_),
+                          key=len, reverse=True)
+        self.patterns = patterns
+        self.regex = None
+        if patterns:
+            self.regex = re.compile('|'.join(re.escape(P) for P in patterns))
+        # A chunk boundary can split a match only within this many characters
+        self.overlap = max([len(P) for P in patterns] or [1]) - 1
+
+    def _lookup(self, match):
+        return self.table[match.group(0)]
+
+    def search(self, s):
+        """Whether any of the patterns occurs in `s`."""
+        if '' in self.table:
+            return True
+        if len(self.patterns) == 1:
+            # str's own search beats the regex engine for a single pattern
+            return self.patterns[0] in s
+        return self.regex is not None and self.regex.search(s) is not None
+
+    def replace(self, s):
+        if not self.search(s):
+            return s
+        if self.single_pass and len(self.renames) > 1:
+            return self.regex.sub(self._lookup, s)
+        for (from_, to_) in self.renames:
+            s = s.replace(from_, to_)
+        return s
+
+    def search_file(self, fp, chunk_size = CHUNK_SIZE):
+        """Whether any of the patterns occurs in the rest of file `fp`."""
+        if '' in self.table:
+            return True
+        tail = ''
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                return False
+            data = tail + chunk
+            if self.search(data):
+                return True
+            tail = data[-self.overlap:] if self.overlap else ''
+
+    def can_stream(self):
+        return self.single_pass and self.regex is not None
+
+    def _replace_upto(self, data, cut, pieces):
+        # Rewrites data up to `cut`, or to the end of a match straddling it
+        pos = 0
+        for match in self.regex.finditer(data):
+            if match.start() >= cut:
+                break
+            pieces.append(data[pos:match.start()])
+            pieces.append(self.table[match.group(0)])
+            pos = match.end()
+        end = max(pos, cut)
+        pieces.append(data[pos:end])
+        return end
+
+    def replace_file(self, infp, outfp, chunk_size = CHUNK_SIZE):
+        """
+        Copy file `infp` to `outfp` with the renames applied.  Unless the
+        renames need the sequential replace the file is processed one chunk
+        at a time, holding back just enough of each chunk to catch the
+        matches that continue into the next one.
+        """
+
+        if not self.can_stream():
+            outfp.write(self.replace(infp.read()))
+            return
+
+        data = ''
+        while True:
+            chunk = infp.read(chunk_size)
+            if not chunk:
+                break
+            data += chunk
+            if len(data) <= self.overlap:
+                continue
+            pieces = []
+            end = self._replace_upto(data, len(data) - self.overlap, pieces)
+            outfp.write(''.join(pieces))
+            data = data[end:]
+
+        pieces = []
+        self._replace_upto(data, len(data), pieces)
+        outfp.write(''.join(pieces))
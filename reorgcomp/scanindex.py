@@ -0,0 +1,176 @@
+# File: scanindex.py
+
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+
+
+INDEX_VERSION = 1
+
+FIELD_SIZE = 0
+FIELD_MTIME = 1
+FIELD_HASH = 2
+FIELD_MIMETYPE = 3
+
+
+def get_index_filename(indexdir, base):
+    key = hashlib.sha1(os.path.abspath(base)).hexdigest()
+    return os.path.join(indexdir, key + '.idx')
+
+
+class ScanIndex(object):
+    """
+    Persistent record of a directory tree: the listing of every directory
+    and the size, mtime, content hash and mime type of every file.
+
+    refresh() brings the index up to date by stat'ing: directories whose
+    mtime is unchanged reuse their stored listing and files whose size and
+    mtime are unchanged keep their stored hash and mime type, so only new or
+    modified files ever need to be read again.
+    """
+
+    def __init__(self, base, filename):
+        self.base = base
+        self.filename = filename
+        self.dirs = {}
+        self.files = {}
+        self.order = []
+        self.dirty = False
+        self.reused = 0
+        self.rescanned = 0
+        self.relisted = 0
+
+    def _full(self, rel):
+        if rel == '':
+            return self.base
+        return os.path.join(self.base, rel)
+
+    def relpath(self, path):
+        if path == self.base:
+            return ''
+        prefix = os.path.join(self.base, '')
+        if path.startswith(prefix):
+            return path[len(prefix):]
+        return None
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as fp:
+                state = pickle.load(fp)
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            return False
+        if state.get('version') != INDEX_VERSION:
+            return False
+        if state.get('base') != os.path.abspath(self.base):
+            return False
+        self.dirs = state['dirs']
+        self.files = state['files']
+        self.order = state['order']
+        return True
+
+    def save(self):
+        if not self.dirty:
+            return
+        indexdir = os.path.dirname(self.filename)
+        if indexdir and not os.path.isdir(indexdir):
+            os.makedirs(indexdir)
+        state = {
+            'version': INDEX_VERSION,
+            'base': os.path.abspath(self.base),
+            'dirs': self.dirs,
+            'files': self.files,
+            'order': self.order,
+        }
+        (fd, tmpname) = tempfile.mkstemp(dir=indexdir or '.', prefix='.idx')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump(state, fp, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, self.filename)
+        except:
+            os.remove(tmpname)
+            raise
+        self.dirty = False
+
+    def refresh(self):
+        dirs = {}
+        files = {}
+        order = []
+        self.reused = 0
+        self.rescanned = 0
+        self.relisted = 0
+        self._scan('', dirs, files, order)
+        if (self.relisted or self.rescanned or order != self.order
+                or len(files) != len(self.files)):
+            self.dirty = True
+        self.dirs = dirs
+        self.files = files
+        self.order = order
+
+    def _scan(self, reldir, dirs, files, order):
+
+        fulldir = self._full(reldir)
+
+        try:
+            mtime = os.stat(fulldir).st_mtime
+        except OSError:
+            return
+
+        old = self.dirs.get(reldir)
+
+        if old is not None and old[0] == mtime:
+            (_, dirnames, filenames) = old
+        else:
+            try:
+                names = os.listdir(fulldir)
+            except OSError:
+                return
+            self.relisted += 1
+            # Same split as os.walk(), so walk() yields identical tuples
+            dirnames = []
+            filenames = []
+            for name in names:
+                if os.path.isdir(os.path.join(fulldir, name)):
+                    dirnames.append(name)
+                else:
+                    filenames.append(name)
+
+        dirs[reldir] = (mtime, dirnames, filenames)
+        order.append(reldir)
+
+        for filename in filenames:
+            relpath = os.path.join(reldir, filename)
+            try:
+                st = os.stat(os.path.join(fulldir, filename))
+            except OSError:
+                continue
+            entry = self.files.get(relpath)
+            if (entry is not None and entry[FIELD_SIZE] == st.st_size
+                    and entry[FIELD_MTIME] == st.st_mtime):
+                self.reused += 1
+            else:
+                entry = [st.st_size, st.st_mtime, None, None]
+                self.rescanned += 1
+            files[relpath] = entry
+
+        for dirname in dirnames:
+            if not os.path.islink(os.path.join(fulldir, dirname)):
+                self._scan(os.path.join(reldir, dirname), dirs, files, order)
+
+    def walk(self):
+        for reldir in self.order:
+            (_, dirnames, filenames) = self.dirs[reldir]
+            yield (self._full(reldir), list(dirnames), list(filenames))
+
+    def get(self, path, field):
+        rel = self.relpath(path)
+        if rel is None or rel not in self.files:
+            return None
+        return self.files[rel][field]
+
+    def set(self, path, field, value):
+        rel = self.relpath(path)
+        if rel is None or rel not in self.files:
+            return
+        self.files[rel][field] = value
+        self.dirty = True
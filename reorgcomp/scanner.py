@@ -0,0 +1,230 @@
+# File: scanner.py
+
+import os
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+
+DEFAULT_CONCURRENCY = 16
+
+# Entries of a directory whose type is checked by one request
+STAT_BATCH = 8
+
+
+def get_kind(path):
+    """
+    (isdir, islink) of a directory entry, as os.walk() tells them apart.
+    """
+    if os.path.isdir(path):
+        return (True, os.path.islink(path))
+    return (False, False)
+
+
+def split_entries(names, kinds):
+    """
+    (dirnames, filenames, links) like os.walk() splits a directory listing,
+    `links` being the dirnames that are symlinks (not descended into).
+    """
+
+    dirnames = []
+    filenames = []
+    links = set()
+
+    for (name, (isdir, islink)) in zip(names, kinds):
+        if isdir:
+            dirnames.append(name)
+            if islink:
+                links.add(name)
+        else:
+            filenames.append(name)
+
+    return (dirnames, filenames, links)
+
+
+def list_dir(path):
+    """
+    os.walk() style split of a directory (see split_entries), with the types
+    taken from the scandir module's listing when it is installed, otherwise
+    from a stat of every entry.
+    """
+
+    if scandir is not None:
+        entries = list(scandir(path))
+        return split_entries([E.name for E in entries],
+                             [(E.is_dir(), E.is_dir() and E.is_symlink()) for E in entries])
+
+    names = os.listdir(path)
+    return split_entries(names, [get_kind(os.path.join(path, N)) for N in names])
+
+
+def _get_kinds(dirpath, names):
+    return [get_kind(os.path.join(dirpath, N)) for N in names]
+
+
+def _call(func, *args):
+    # Errors are handed back as results: callbacks are only called on success
+    try:
+        return (True, func(*args))
+    except EnvironmentError, error:
+        return (False, error)
+
+
+class _Listing(object):
+    """
+    A directory being listed in the background.  Without scandir, the types
+    of its entries are then checked STAT_BATCH at a time by further requests
+    on the same pool.  Once it is listed, the listings of its subdirectories
+    are started in turn, so the whole tree is being scanned while the walk
+    goes through it.  All of that is issued from the completion callbacks,
+    so no worker ever waits for another.
+    """
+
+    def __init__(self, scanner, path):
+        self.scanner = scanner
+        self.path = path
+        self.result = None
+        self.children = {}
+        self.done = threading.Event()
+
+        if scandir is not None:
+            submitted = scanner._submit(self._finish, list_dir, path)
+        else:
+            submitted = scanner._submit(self._listed, os.listdir, path)
+        if not submitted:
+            self.done.set()
+
+    def _finish(self, (ok, result)):
+        if ok:
+            (dirnames, filenames, links) = result
+            for dirname in dirnames:
+                if dirname not in links:
+                    self.children[dirname] = _Listing(self.scanner, os.path.join(self.path, dirname))
+            self.result = result
+        self.done.set()
+
+    def _listed(self, (ok, names)):
+
+        if not ok or not names:
+            self._finish((ok, split_entries([], [])))
+            return
+
+        self.names = names
+        self.kinds = [None] * len(names)
+
+        batches = range(0, len(names), STAT_BATCH)
+        self.remaining = len(batches)
+        for start in batches:
+            callback = lambda result, start = start: self._checked(start, result)
+            if not self.scanner._submit(callback, _get_kinds, self.path,
+                                        names[start:start + STAT_BATCH]):
+                # The scanner is being closed, nobody waits for this anymore
+                self.done.set()
+                return
+
+    def _checked(self, start, (ok, kinds)):
+        # Callbacks all run on the pool's result thread, one at a time
+        if ok:
+            self.kinds[start:start + len(kinds)] = kinds
+        self.remaining -= 1
+        if self.remaining == 0:
+            kinds = [K or (False, False) for K in self.kinds]
+            self._finish((True, split_entries(self.names, kinds)))
+
+    def get(self):
+        # No timeout: Python 2 implements those by polling, with sleeps of up
+        # to 50ms which would dwarf the latency this is all about.
+        self.done.wait()
+        return self.result
+
+
+class Scanner(object):
+    """
+    Walks directory trees and runs per file operations (stat, hash, ...)
+    with up to `concurrency` requests in flight, on threads: on a network
+    filesystem the time goes into waiting for the server, which a single
+    thread can only do one request at a time.  walk() and map() give the
+    same results, in the same order, as os.walk() and map().
+
+    The thread pool is started on first use in every process, so a scanner
+    also works in worker processes forked after it was used.
+    """
+
+    def __init__(self, concurrency = DEFAULT_CONCURRENCY):
+        self.concurrency = concurrency
+        self.pool = None
+        self.pid = None
+        self.lock = None
+        self.closing = False
+
+    def _get_pool(self):
+        if self.pool is None or self.pid != os.getpid():
+            self.pool = ThreadPool(self.concurrency)
+            self.pid = os.getpid()
+            # A lock inherited through fork() could have been held
+            self.lock = threading.Lock()
+            self.closing = False
+        return self.pool
+
+    def _submit(self, callback, func, *args):
+        """
+        Start func(*args) in the background, `callback` getting the result
+        of _call().  Listings still going on when the scanner is closed keep
+        asking from their callbacks: those requests are refused (False), as
+        the closed pool can't take them anymore.
+        """
+        with self.lock:
+            if self.closing:
+                return False
+            self.pool.apply_async(_call, (func,) + args, callback = callback)
+            return True
+
+    def walk(self, top):
+        """
+        Top-down os.walk() of `top`, the tree being listed in the background
+        ahead of it.  Like with os.walk() the caller can prune `dirnames` to
+        skip some of the subdirectories (they are still scanned, just not
+        walked).  Directories that can't be listed are left out.
+        """
+
+        self._get_pool()
+
+        stack = [_Listing(self, top)]
+
+        while stack:
+
+            listing = stack.pop()
+
+            result = listing.get()
+            if result is None:
+                continue
+            (dirnames, filenames, links) = result
+
+            yield (listing.path, dirnames, filenames)
+
+            for dirname in reversed(dirnames):
+                if dirname in listing.children:
+                    stack.append(listing.children[dirname])
+
+    def map(self, func, items):
+        """
+        [func(item) for item in items], with the calls made concurrently.
+        """
+        items = list(items)
+        if not items:
+            return []
+        chunksize = max(1, min(64, len(items) / (self.concurrency * 4)))
+        return self._get_pool().map(func, items, chunksize)
+
+    def close(self):
+        if self.pool is not None and self.pid == os.getpid():
+            with self.lock:
+                self.closing = True
+                self.pool.close()
+            self.pool.join()
+        self.pool = None
@@ -0,0 +1,84 @@
+# File: stats.py
+
+import time
+import functools
+
+
+class Stats(object):
+    """
+    Number of calls, total time and, optionally, amount of data (bytes read,
+    files walked, ...) of instrumented functions.  Functions are instrumented
+    by replacing them with the wrappers from wrap() or wrap_iter(), so that
+    nothing is measured, nor slowed down, unless asked for.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.order = []
+
+    def _counter(self, name, unit):
+        if name not in self.counters:
+            self.counters[name] = [0, 0.0, 0, unit]
+            self.order.append(name)
+        return self.counters[name]
+
+    def wrap(self, name, func, measure = None, unit = None):
+        """
+        Time the calls of `func` under `name`, adding up measure(result) as
+        the amount of data processed (in `unit`) if given.
+        """
+
+        counter = self._counter(name, unit)
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                counter[0] += 1
+                counter[1] += time.time() - start
+            if measure is not None:
+                counter[2] += measure(result)
+            return result
+
+        return timed
+
+    def wrap_iter(self, name, func, measure = None, unit = None):
+        """
+        Like wrap() for a function returning an iterator: the time spent
+        producing each item is counted, not the time the caller spends on it.
+        """
+
+        counter = self._counter(name, unit)
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.time()
+            iterator = iter(func(*args, **kwargs))
+            counter[0] += 1
+            while True:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    counter[1] += time.time() - start
+                    return
+                counter[1] += time.time() - start
+                if measure is not None:
+                    counter[2] += measure(item)
+                yield item
+                start = time.time()
+
+        return timed
+
+    def report(self):
+        lines = []
+        for name in self.order:
+            (calls, seconds, amount, unit) = self.counters[name]
+            line = "stats: %-12s %9d calls %10.3fs" % (name, calls, seconds,)
+            if calls:
+                line += " %10.1f us/call" % (1e6 * seconds / calls,)
+            if unit is not None:
+                line += " %12d %s" % (amount, unit,)
+            lines.append(line)
+        return '\n'.join(lines)
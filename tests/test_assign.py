@@ -0,0 +1,41 @@
+# File: test_assign.py
+
+####
+
+from reorgcomp.assign import get_components
+from reorgcomp.assign import max_weight_matching
+
+####
+
+
+def test_components():
+
+	edges = [("a", "x", 1.0), ("b", "y", 1.0), ("c", "x", 0.5)]
+	components = get_components(edges)
+
+	assert components == [[("a", "x", 1.0), ("c", "x", 0.5)], [("b", "y", 1.0)]], components
+
+
+def test_better_than_greedy():
+
+	# Greedy gives x to 'a' (0.9) and leaves 'b' with nothing
+	edges = [
+		("a", "x", 0.9),
+		("a", "y", 0.8),
+		("b", "x", 0.85),
+	]
+
+	matching = max_weight_matching(edges)
+	assert matching == {"a": ("y", 0.8), "b": ("x", 0.85)}, matching
+
+
+def test_unmatched():
+
+	edges = [
+		("a", "x", 0.9),
+		("b", "x", 0.5),
+		("c", "x", 0.4),
+	]
+
+	matching = max_weight_matching(edges)
+	assert matching == {"a": ("x", 0.9)}, matching
@@ -2,8 +2,14 @@
 
 ####
 
+import os
+import sys
+
 from os import path
+from StringIO import StringIO
 
+import re
+import shutil
 import tempfile
 
 from nose.tools import with_setup
@@ -15,7 +21,23 @@ import reorgcomp.rename
 from reorgcomp.rename import save_output
 from reorgcomp.rename import read_input
 from reorgcomp.rename import detect_moves
+from reorgcomp.rename import detect_move
+from reorgcomp.rename import get_ratio
+from reorgcomp.rename import get_line_ratio
+from reorgcomp.rename import get_char_ratio
+from reorgcomp.rename import chain_stages
+from reorgcomp.rename import find_duplicate_targets
+from reorgcomp.rename import iter_filtered_picks
+from reorgcomp.rename import run_pipeline
+from reorgcomp.rename import check_pipeline_spec
+from reorgcomp.rename import iter_assigned_moves
+from reorgcomp.rename import pick_moves
+from reorgcomp.rename import get_diff
+from reorgcomp.rename import print_diffs
 from reorgcomp.rename import rename_dirs
+from reorgcomp.rename import rename_tree
+from reorgcomp.rename import fixname_file
+from reorgcomp.rename import fixnameable_file
 from reorgcomp.rename import parse_arguments
 
 ####
@@ -83,6 +105,31 @@ def test_rename_target():
 	rename_dirs(os_walk=_walk, os_rename=_rename)
 	
 
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_fixname_file():
+
+	import stat
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		filename = path.join(tmpdir, "content.txt")
+		with open(filename, 'w') as fp:
+			fp.write("widget.h\nsrc/widget.c\n")
+		os.chmod(filename, 0750)
+
+		parse_arguments(["--addrename", "widget", "gadget"])
+		assert fixnameable_file(filename)
+		fixname_file(filename)
+
+		with open(filename) as fp:
+			assert fp.read() == "gadget.h\nsrc/gadget.c\n"
+		assert stat.S_IMODE(os.stat(filename).st_mode) == 0750
+		assert os.listdir(tmpdir) == ["content.txt"]
+		assert not fixnameable_file(filename)
+	finally:
+		shutil.rmtree(tmpdir)
+
+
 def unpretend(val):
 	def func():
 		reorgcomp.rename.PRETEND_OPS = val
@@ -104,3 +151,683 @@ def test_pretend():
 	rename_dirs(_walk, _rename)
 
 	assert notcalled[0]
+
+
+def reset_rename():
+	reorgcomp.rename.PRETEND_OPS = False
+	reorgcomp.rename._rename_target = "."
+	parse_arguments([])
+
+
+@with_setup(teardown=reset_rename)
+def test_rename_tree():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		os.mkdir(path.join(tmpdir, "widgets"))
+		for name in ("widget.txt", "other.txt"):
+			with open(path.join(tmpdir, "widgets", name), 'w') as fp:
+				fp.write("a widget\n" if name == "widget.txt" else "nothing\n")
+
+		planfile = path.join(tmpdir, "plan.txt")
+		parse_arguments(["--pretend", "--rename_target", tmpdir,
+			"--addrename", "widget", "gadget"])
+
+		plan = rename_tree(planfile)
+		assert os.listdir(path.join(tmpdir, "widgets"))
+		assert read_input(planfile) == plan
+		assert [step[0] for step in plan] == ["dir", "file", "content"]
+		assert plan[1][1] == path.join(tmpdir, "gadgets", "widget.txt")
+		assert plan[2][1] == path.join(tmpdir, "gadgets", "gadget.txt")
+
+		reorgcomp.rename.PRETEND_OPS = False
+		rename_tree(planfile, resume=True, jobs=2)
+
+		assert sorted(os.listdir(path.join(tmpdir, "gadgets"))) == ["gadget.txt", "other.txt"]
+		with open(path.join(tmpdir, "gadgets", "gadget.txt")) as fp:
+			assert fp.read() == "a gadget\n"
+		with open(planfile + ".done") as fp:
+			assert sorted(fp.read().split()) == ["0", "1", "2"]
+
+		# Everything is journaled, so resuming has nothing left to do
+		rename_tree(planfile, resume=True)
+	finally:
+		shutil.rmtree(tmpdir)
+
+
+@with_setup(teardown=reset_rename)
+def test_rewrite_journaled_by_worker():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		filename = path.join(tmpdir, "notes.txt")
+		with open(filename, 'w') as fp:
+			fp.write("a widget\n")
+		journal = path.join(tmpdir, "plan.txt.done")
+
+		parse_arguments(["--addrename", "widget", "gadget"])
+		# Done without the parent ever seeing the result
+		reorgcomp.rename._fixname_file_job((7, filename, journal))
+
+		assert reorgcomp.rename.read_journal(journal) == set([7])
+	finally:
+		shutil.rmtree(tmpdir)
+
+
+def test_detectmoves_parallel():
+
+	serial = detect_moves("tests/data/B", "tests/data/A")
+	parallel = detect_moves("tests/data/B", "tests/data/A", jobs=2)
+
+	assert serial == parallel, (serial, parallel)
+
+
+def test_detectmoves_incremental():
+
+	tmpdir = tempfile.mkdtemp()
+	calls = []
+
+	def counting_detect_move(basenew, oldfile):
+		calls.append(oldfile)
+		return detect_move(basenew, oldfile)
+
+	try:
+		old = path.join(tmpdir, "A")
+		new = path.join(tmpdir, "B")
+		shutil.copytree("tests/data/A", old)
+		shutil.copytree("tests/data/B", new)
+		with open(path.join(old, "Unrelated.txt"), 'w') as fp:
+			fp.write("unrelated\n")
+
+		moves = path.join(tmpdir, "moves.txt")
+		state = path.join(tmpdir, "state.txt")
+
+		reorgcomp.rename.detect_move = counting_detect_move
+
+		first = detect_moves(new, old, moves, state=state)
+		assert len(calls) == 2
+
+		# Nothing changed: everything is taken over
+		del calls[:]
+		again = detect_moves(new, old, moves, previous=moves, state=state)
+		assert calls == []
+		assert again == first
+
+		# A new candidate only invalidates the old file with that name
+		os.mkdir(path.join(new, "qux"))
+		shutil.copy("tests/data/A/foo/bar/baz/Greeting.txt", path.join(new, "qux"))
+		reorgcomp.rename._names_cache.invalidate()
+		del calls[:]
+		updated = detect_moves(new, old, moves, previous=moves, state=state)
+		assert calls == [path.join(old, "foo", "bar", "baz", "Greeting.txt")]
+
+		reorgcomp.rename.detect_move = detect_move
+		assert updated == detect_moves(new, old)
+	finally:
+		reorgcomp.rename.detect_move = detect_move
+		shutil.rmtree(tmpdir)
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_detectmoves_find_dirs():
+
+	parse_arguments(["--find-dirs"])
+
+	actual = detect_moves("tests/data/B", "tests/data/A")
+	expected = [
+		('tests/data/A/foo/bar/baz/', [('tests/data/B/baz/bar/foo/', 1.0)]),
+		]
+	assert expected == actual, (expected, actual)
+
+	picks = [(orig, matches[0][0]) for (orig, matches) in actual]
+	assert list(reorgcomp.rename.iter_ratios(picks)) == [picks[0] + (1.0,)]
+
+	# Only the file that isn't part of the moved directory is left over
+	withaddsdels = reorgcomp.rename.add_adds_and_deletes(picks, "tests/data/A", "tests/data/B")
+	assert set(move[:2] for move in withaddsdels) == set([
+		picks[0], (None, 'tests/data/B/baz/Greeting.txt')])
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_detectmoves_state_find_similar():
+
+	tmpdir = tempfile.mkdtemp()
+	builds = []
+	get_similar_files = reorgcomp.rename.get_similar_files
+
+	def recording_get_similar_files(scandir, data, jobs = 1):
+		if scandir not in reorgcomp.rename._get_similarity_index_cache:
+			builds.append(jobs)
+		return get_similar_files(scandir, data, jobs)
+
+	try:
+		parse_arguments(["--find-similar"])
+		reorgcomp.rename.get_similar_files = recording_get_similar_files
+		reorgcomp.rename._get_similarity_index_cache.pop("tests/data/B", None)
+
+		# The move keys need the index first, it's still built by the pool
+		detect_moves("tests/data/B", "tests/data/A", jobs=2,
+			state=path.join(tmpdir, "state.txt"))
+		assert builds == [2], builds
+	finally:
+		reorgcomp.rename.get_similar_files = get_similar_files
+		shutil.rmtree(tmpdir)
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_detectmoves_find_dirs_claimed():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		for name in ("old/a/x/f.txt", "old/z/f.txt", "new/y/x/f.txt"):
+			fullpath = path.join(tmpdir, name)
+			if not path.isdir(path.dirname(fullpath)):
+				os.makedirs(path.dirname(fullpath))
+			with open(fullpath, 'w') as fp:
+				fp.write("same\n")
+
+		parse_arguments(["--find-dirs"])
+		(baseold, basenew) = (path.join(tmpdir, "old"), path.join(tmpdir, "new"))
+		# new/y/x/f.txt went along with old/a, old/z/f.txt can't have it too
+		expected = [
+			(path.join(baseold, "a", ""), [(path.join(basenew, "y", ""), 1.0)]),
+			(path.join(baseold, "z", "f.txt"), []),
+			]
+		for jobs in (1, 2):
+			actual = detect_moves(basenew, baseold, jobs = jobs)
+			assert actual == expected, (jobs, actual)
+	finally:
+		shutil.rmtree(tmpdir)
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_detectmoves_find_dirs_in_place():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		files = {
+			"old/z/main.py": "edited\n",
+			"old/z/x/__init__.py": "x\n",
+			"new/z/main.py": "main\n",
+			"new/z/x/__init__.py": "x\n",
+			"new/c/x/__init__.py": "x\n",
+		}
+		for (name, content) in files.items():
+			fullpath = path.join(tmpdir, name)
+			if not path.isdir(path.dirname(fullpath)):
+				os.makedirs(path.dirname(fullpath))
+			with open(fullpath, 'w') as fp:
+				fp.write(content)
+
+		parse_arguments(["--find-dirs"])
+		(baseold, basenew) = (path.join(tmpdir, "old"), path.join(tmpdir, "new"))
+		actual = detect_moves(basenew, baseold)
+		assert actual[0] == (path.join(baseold, "z", "x", ""),
+			[(path.join(basenew, "z", "x", ""), 1.0)]), actual
+	finally:
+		shutil.rmtree(tmpdir)
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_detectmoves_scan_threads():
+
+	expected = detect_moves("tests/data/B", "tests/data/A")
+
+	parse_arguments(["--scan-threads", "4", "--find-renames"])
+	assert detect_moves("tests/data/B", "tests/data/A") == expected
+	assert detect_moves("tests/data/B", "tests/data/A", jobs=2) == expected
+
+
+def test_ratio_cutoff():
+
+	same = "hello world\n"
+	other = "goodbye cruel world, it was nice knowing you\n"
+
+	assert get_ratio(same, same, 0.9) == get_ratio(same, same)
+	assert get_ratio(same, other, 0.9) is None
+	assert get_ratio(same, other, 0.0) == get_ratio(same, other)
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_detectmove_min_ratio():
+
+	parse_arguments(["--min-ratio", "0.5"])
+	actual = detect_move("tests/data/B", "tests/data/A/foo/bar/baz/Greeting.txt")
+	assert actual == [('tests/data/B/baz/bar/foo/Greeting.txt', 1.0)], actual
+
+	parse_arguments(["--best-only"])
+	actual = detect_move("tests/data/B", "tests/data/A/foo/bar/baz/Greeting.txt")
+	assert actual == [('tests/data/B/baz/bar/foo/Greeting.txt', 1.0)], actual
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_detectmove_find_renames():
+
+	basenew = tempfile.mkdtemp()
+	try:
+		shutil.copy("tests/data/B/baz/bar/foo/Greeting.txt", path.join(basenew, "Hello.txt"))
+
+		oldfile = "tests/data/A/foo/bar/baz/Greeting.txt"
+
+		actual = detect_move(basenew, oldfile)
+		assert actual == [], actual
+
+		parse_arguments(["--find-renames"])
+		actual = detect_move(basenew, oldfile)
+		assert actual == [(path.join(basenew, "Hello.txt"), 1.0)], actual
+
+	finally:
+		shutil.rmtree(basenew)
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_detectmove_best_only_renamed_copy():
+
+	basenew = tempfile.mkdtemp()
+	try:
+		oldfile = "tests/data/A/foo/bar/baz/Greeting.txt"
+		with open(oldfile) as fp:
+			data = fp.read()
+
+		os.mkdir(path.join(basenew, "x"))
+		edited = path.join(basenew, "x", "Greeting.txt")
+		with open(edited, 'w') as fp:
+			fp.write(data + "And goodbye.\n")
+		shutil.copy(oldfile, path.join(basenew, "Copy.txt"))
+
+		# The identical copy isn't a match without --find-renames, it
+		# mustn't keep the edited file from being the best one
+		parse_arguments(["--best-only"])
+		actual = detect_move(basenew, oldfile)
+		assert len(actual) == 1 and actual[0][0] == edited, actual
+		assert basenew not in reorgcomp.rename._get_hash_index_cache
+
+		parse_arguments(["--best-only", "--find-renames"])
+		actual = detect_move(basenew, oldfile)
+		assert actual == [(path.join(basenew, "Copy.txt"), 1.0)], actual
+
+	finally:
+		shutil.rmtree(basenew)
+
+
+test_chain_file = T("test_chain_file")
+
+@with_setup(teardown=delete_later(test_chain_file))
+def test_chain_stages():
+
+	greeting_a = "tests/data/A/foo/bar/baz/Greeting.txt"
+	greeting_b = "tests/data/B/baz/Greeting.txt"
+	greeting_c = "tests/data/B/baz/bar/foo/Greeting.txt"
+
+	picks = [
+		(greeting_b, greeting_a),
+		(greeting_c, greeting_a),
+		(greeting_a, greeting_c),
+	]
+
+	save_output(test_chain_file, picks)
+
+	records = chain_stages(iter(picks), ["ratio", "duplicates"], None)
+	assert not isinstance(records, list)
+
+	expected = [(greeting_a, [(greeting_b, get_ratio(open(greeting_b).read(), open(greeting_a).read())),
+	                          (greeting_c, 1.0)])]
+	actual = list(records)
+	assert expected == actual, (expected, actual)
+
+	actual = list(chain_stages(iter(picks), ["duplicates"], None))
+	assert actual == find_duplicate_targets(test_chain_file)
+
+
+def test_filter_picks():
+
+	picks = [("a/foo", "b/foo", 0.5), ("a/bar", "b/bar")]
+
+	actual = list(iter_filtered_picks(iter(picks), include=re.compile("foo")))
+	assert actual == picks[:1], actual
+
+	actual = list(iter_filtered_picks(iter(picks), exclude=re.compile("foo")))
+	assert actual == picks[1:], actual
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_pipeline():
+
+	config = parse_arguments(["--basenew", "tests/data/B", "--baseold", "tests/data/A"])
+	spec = [
+		("findmoves", {}),
+		("top", {}),
+		("ratio", {}),
+		("filter", {"exclude": "Nothing"}),
+		("duplicates", {}),
+		("undupe", {}),
+		("unresolve", {}),
+	]
+
+	expected = [("tests/data/A/foo/bar/baz/Greeting.txt", "tests/data/B/baz/bar/foo/Greeting.txt", 1.0)]
+	actual = run_pipeline(spec, config)
+
+	assert expected == actual, (expected, actual)
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_check_pipeline_spec():
+
+	config = parse_arguments(["--baseold", "tests/data/A"])
+	spec = [("findmoves", {}), ("top", {})]
+
+	message = check_pipeline_spec(spec, config)
+	assert message and "--basenew" in message, message
+
+	spec[0] = ("findmoves", {"basenew": "tests/data/B"})
+	assert check_pipeline_spec(spec, config) is None
+
+	spec.append(("w_addsdels", {}))
+	message = check_pipeline_spec(spec, config)
+	assert message and "'w_addsdels'" in message, message
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_detectmove_find_similar():
+
+	basenew = tempfile.mkdtemp()
+	baseold = tempfile.mkdtemp()
+	try:
+		text = "".join("line %d of the old file\n" % (i,) for i in range(200))
+
+		oldfile = path.join(baseold, "Old.txt")
+		with open(oldfile, 'w') as fp:
+			fp.write(text)
+
+		newfile = path.join(basenew, "New.txt")
+		with open(newfile, 'w') as fp:
+			fp.write(text.replace("line 100 ", "changed line 100 "))
+
+		assert detect_move(basenew, oldfile) == []
+
+		parse_arguments(["--find-similar"])
+		# The similarity index of basenew gets built by the worker pool
+		moves = detect_moves(basenew, baseold, jobs = 2)
+		assert [dest for (dest, _) in moves[0][1]] == [newfile], moves
+
+		actual = detect_move(basenew, oldfile)
+		assert len(actual) == 1 and actual[0][0] == newfile, actual
+		assert 0.9 < actual[0][1] < 1.0, actual
+
+	finally:
+		shutil.rmtree(basenew)
+		shutil.rmtree(baseold)
+
+
+def test_line_ratio():
+
+	text = "".join("line %d\n" % (i,) for i in range(100))
+	edited = text.replace("line 50\n", "line fifty\n")
+
+	assert get_line_ratio(text, text) == 1.0
+	assert get_line_ratio("", "") == 1.0
+	assert get_line_ratio(text, "") == 0.0
+
+	ratio = get_line_ratio(text, edited)
+	expected = 2.0 * (len(text) - len("line 50\n")) / (len(text) + len(edited))
+	assert ratio == expected, (ratio, expected)
+
+	assert get_line_ratio(text, edited, 0.99) is None
+	assert get_line_ratio(text, edited, 0.9) == ratio
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_scorer_option():
+
+	text = "".join("line %d\n" % (i,) for i in range(100))
+	edited = text.replace("line 50\n", "line fifty\n")
+
+	parse_arguments(["--scorer", "lines"])
+	assert get_ratio(text, edited) == get_line_ratio(text, edited)
+
+	# 'auto' goes by the old file alone, whatever the size of the candidate
+	parse_arguments(["--scorer", "auto"])
+	small = text[:len(text) / 2]
+	saved = reorgcomp.rename.AUTO_SCORER_LINES_SIZE
+	reorgcomp.rename.AUTO_SCORER_LINES_SIZE = len(small)
+	try:
+		assert get_ratio(small, edited) == get_char_ratio(small, edited)
+		assert get_ratio(edited, small) == get_line_ratio(edited, small)
+	finally:
+		reorgcomp.rename.AUTO_SCORER_LINES_SIZE = saved
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_ratio_cache():
+
+	tmpdir = tempfile.mkdtemp()
+	scored = []
+
+	def counting_char_ratio(data1, data2, cutoff = None):
+		scored.append((data1, data2))
+		return get_char_ratio(data1, data2, cutoff)
+
+	try:
+		parse_arguments(["--ratio-cache", path.join(tmpdir, "ratios.sqlite")])
+		reorgcomp.rename.get_char_ratio = counting_char_ratio
+
+		first = get_ratio("hello world", "hello there")
+		assert get_ratio("hello world", "hello there") == first
+		assert get_ratio("hello world", "hello there", 0.99) is None
+		assert len(scored) == 1
+
+		# A new run finds the ratios of the previous one
+		parse_arguments(["--ratio-cache", path.join(tmpdir, "ratios.sqlite")])
+		assert get_ratio("hello world", "hello there") == first
+		assert len(scored) == 1
+	finally:
+		reorgcomp.rename.get_char_ratio = get_char_ratio
+		parse_arguments([])
+		shutil.rmtree(tmpdir)
+
+
+@with_setup(teardown=lambda: parse_arguments([]))
+def test_stats_option():
+
+	original = reorgcomp.rename.get_ratio
+
+	parse_arguments(["--stats"])
+	assert reorgcomp.rename.get_ratio is not original
+	detect_move("tests/data/B", "tests/data/A/foo/bar/baz/Greeting.txt")
+
+	counters = reorgcomp.rename._stats.counters
+	assert counters["walk"][0] == 1
+	assert counters["read"][0] == 2
+	assert counters["score"][0] == 1
+
+	# Without --stats the hot paths are the plain functions again
+	parse_arguments([])
+	assert reorgcomp.rename.get_ratio is original
+	assert reorgcomp.rename._stats is None
+
+
+def test_print_diffs_parallel():
+
+	tmpdir = tempfile.mkdtemp()
+	window = reorgcomp.rename.DIFF_WINDOW
+	try:
+		names = []
+		for i in range(7):
+			names.append(path.join(tmpdir, "file%d.txt" % (i,)))
+			with open(names[-1], 'w') as fp:
+				fp.write("".join("line %d\n" % (j * (i % 3 + 1),) for j in range(20)))
+
+		moves = [(names[0], names[3]), (names[0], names[1]), (None, names[2]),
+			(names[4], None), (names[5], names[6])] * 3
+
+		# The first pair is identical: an empty diff, found by its hash
+		assert get_diff(moves[0]) == ''
+		assert get_diff(moves[1]).startswith("--- %s\n" % (names[0],))
+
+		serial = path.join(tmpdir, "serial.diff")
+		parallel = path.join(tmpdir, "parallel.diff")
+
+		reorgcomp.rename.DIFF_WINDOW = 4
+		print_diffs(moves, serial)
+		print_diffs(moves, parallel, jobs=3)
+
+		with open(serial) as fp:
+			expected = fp.read()
+		with open(parallel) as fp:
+			assert fp.read() == expected
+		assert expected.count("+++ ") == 12
+	finally:
+		reorgcomp.rename.DIFF_WINDOW = window
+		shutil.rmtree(tmpdir)
+
+
+def test_print_diffs_bundle():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		old = path.join(tmpdir, "old.txt")
+		new = path.join(tmpdir, "new.txt")
+		with open(old, 'w') as fp:
+			fp.write("one\ntwo\nthree\n")
+		with open(new, 'w') as fp:
+			fp.write("one\n2\nthree\nfour\n")
+
+		outfile = path.join(tmpdir, "all.diff")
+		bundle = path.join(tmpdir, "bundle")
+		print_diffs([(old, new, 0.5), (new, new), (None, old)], outfile, bundle=bundle)
+
+		index = read_input(path.join(bundle, "index.jsonl"))
+		assert [entry[:6] for entry in index] == [
+			(old, new, 0.5, 2, 1, "000000.patch"),
+			(new, new, None, 0, 0, "000001.patch"),
+			(None, old, None, 4, 0, "000002.patch"),
+			]
+
+		with open(outfile) as fp:
+			output = fp.read()
+		for entry in index:
+			with open(path.join(bundle, entry[5])) as fp:
+				patch = fp.read()
+			(offset, size) = entry[6:]
+			assert output[offset:offset + size] == patch
+
+		# Nothing to point into when the diffs go to stdout
+		shutil.rmtree(bundle)
+		(stdout, sys.stdout) = (sys.stdout, StringIO())
+		try:
+			print_diffs([(old, new, 0.5)], bundle=bundle)
+		finally:
+			sys.stdout = stdout
+		index = read_input(path.join(bundle, "index.jsonl"))
+		assert index[0][6] is None and index[0][7] > 0, index
+	finally:
+		shutil.rmtree(tmpdir)
+
+
+def test_assigned_moves():
+
+	moves = [
+		("old/a", [("new/x", 0.9), ("new/y", 0.8)]),
+		("old/b", [("new/x", 0.85), ("new/z", -1)]),
+		("old/c", []),
+	]
+
+	expected = [("old/a", "new/y", 0.8), ("old/b", "new/x", 0.85)]
+	actual = list(iter_assigned_moves(iter(moves)))
+
+	assert expected == actual, (expected, actual)
+
+
+def answers(*inputs):
+	inputs = list(inputs)
+	def _raw_input():
+		inp = inputs.pop(0)
+		if isinstance(inp, BaseException):
+			raise inp
+		return inp
+	return _raw_input
+
+
+def del_raw_input():
+	parse_arguments([])
+	del reorgcomp.rename.raw_input
+
+
+@with_setup(teardown=del_raw_input)
+def test_pick_auto_accept():
+
+	parse_arguments(["--auto-accept", "0.9"])
+	reorgcomp.rename.raw_input = answers('n', 'a')
+
+	moves = [
+		("old/a", [("new/x", 0.95), ("new/y", 0.5)]),
+		("old/b", [("new/x", 0.95), ("new/y", 0.9)]),
+		("old/c", []),
+	]
+
+	actual = pick_moves(iter(moves))
+	expected = [("old/a", "new/x"), ("old/b", "new/y"), ("old/c", None)]
+	assert expected == actual, (expected, actual)
+
+
+@with_setup(teardown=del_raw_input)
+def test_pick_order():
+
+	parse_arguments(["--auto-accept", "0.9"])
+	reorgcomp.rename.raw_input = answers('a')
+
+	moves = [
+		("old/a", [("new/x", 0.6), ("new/y", 0.5)]),
+		("old/b", [("new/y", 0.95)]),
+	]
+
+	# Auto-accepted or not, the picks follow the order of the moves
+	actual = pick_moves(iter(moves))
+	expected = [("old/a", "new/x"), ("old/b", "new/y")]
+	assert expected == actual, (expected, actual)
+
+
+def test_replace_output():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		outfile = path.join(tmpdir, "picks.jsonl")
+		save_output(outfile, [("old/a", "new/x")])
+
+		def interrupted():
+			yield ("old/a", "new/x")
+			raise KeyboardInterrupt()
+
+		try:
+			reorgcomp.rename.replace_output(outfile, interrupted())
+		except KeyboardInterrupt:
+			pass
+		else:
+			assert False
+
+		# What was saved before is still there, and nothing else
+		assert read_input(outfile) == [("old/a", "new/x")]
+		assert os.listdir(tmpdir) == ["picks.jsonl"]
+
+		reorgcomp.rename.replace_output(outfile, [("old/b", None)])
+		assert read_input(outfile) == [("old/b", None)]
+	finally:
+		shutil.rmtree(tmpdir)
+
+
+@with_setup(teardown=del_raw_input)
+def test_pick_resume():
+
+	saved = []
+	moves = [
+		("old/a", [("new/x", 0.95)]),
+		("old/b", [("new/x", 0.95)]),
+	]
+
+	reorgcomp.rename.raw_input = answers('a', KeyboardInterrupt())
+	assert pick_moves(iter(moves), save=saved.append) is None
+	assert saved[-1] == [("old/a", "new/x")], saved
+
+	reorgcomp.rename.raw_input = answers('r')
+	actual = pick_moves(iter(moves), list(saved[-1]), saved.append)
+	assert actual == [("old/a", "new/x")], actual
@@ -0,0 +1,61 @@
+# File: test_classify.py
+
+####
+
+import os
+import shutil
+import tempfile
+
+from reorgcomp.classify import sniff
+from reorgcomp.classify import Classifier
+from reorgcomp.classify import MODE_FAST
+
+####
+
+
+def test_sniff():
+
+	assert sniff("hello\tworld\r\n") is True
+	assert sniff("caf\xc3\xa9\n") is True
+	assert sniff("caf\xc3") is True
+	assert sniff("\x89PNG\r\n\x1a\n\0\0\0\rIHDR") is False
+	assert sniff("\xff\xfe\xfd plain" * 10) is None
+
+
+def test_classifier_memo():
+
+	calls = []
+
+	def _mimetype(filename):
+		calls.append(filename)
+		return "text/plain"
+
+	classifier = Classifier(_mimetype)
+	greeting = "tests/data/B/baz/Greeting.txt"
+
+	assert classifier.is_text(greeting)
+	assert classifier.is_text(greeting)
+
+	assert calls == [greeting], calls
+	assert classifier.hits == 1
+
+
+def test_classifier_fast():
+
+	def _mimetype(filename):
+		raise AssertionError("libmagic should not be needed for %s" % (filename,))
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		binfile = os.path.join(tmpdir, "data.bin")
+		with open(binfile, 'wb') as fp:
+			fp.write("abc\0def")
+
+		classifier = Classifier(_mimetype, MODE_FAST)
+
+		assert classifier.is_text("tests/data/B/baz/Greeting.txt")
+		assert not classifier.is_text(binfile)
+		assert classifier.by_magic == 0
+
+	finally:
+		shutil.rmtree(tmpdir)
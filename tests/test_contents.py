@@ -0,0 +1,68 @@
+# File: test_contents.py
+
+####
+
+import os
+import shutil
+import hashlib
+import tempfile
+
+import reorgcomp.contents
+
+from reorgcomp.contents import ContentCache
+from reorgcomp.contents import open_view
+
+####
+
+
+def write(filename, data):
+	with open(filename, 'wb') as fp:
+		fp.write(data)
+
+
+def test_read_cached():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		first = os.path.join(tmpdir, "first")
+		second = os.path.join(tmpdir, "second")
+		write(first, "a" * 10)
+		write(second, "b" * 10)
+
+		cache = ContentCache(max_bytes=15)
+
+		assert cache.read(first) == "a" * 10
+		assert cache.read(first) == "a" * 10
+		assert (cache.hits, cache.misses) == (1, 1)
+
+		# Doesn't fit next to the first one, which gets evicted
+		assert cache.read(second) == "b" * 10
+		assert cache.entries.keys() == [second]
+		assert cache.size == 10
+
+		write(second, "changed")
+		os.utime(second, (0, 0))
+		assert cache.read(second) == "changed"
+
+	finally:
+		shutil.rmtree(tmpdir)
+
+
+def test_view_mmap():
+
+	tmpdir = tempfile.mkdtemp()
+	saved = reorgcomp.contents.MMAP_SIZE
+	try:
+		filename = os.path.join(tmpdir, "big")
+		write(filename, "x" * 100)
+		reorgcomp.contents.MMAP_SIZE = 10
+
+		with open_view(filename) as view:
+			assert not isinstance(view, str)
+			assert view[:] == "x" * 100
+
+		assert ContentCache().hash(filename) == hashlib.sha1("x" * 100).digest()
+
+	finally:
+		reorgcomp.contents.MMAP_SIZE = saved
+		shutil.rmtree(tmpdir)
@@ -0,0 +1,109 @@
+# File: test_dirsig.py
+
+####
+
+import os
+
+from reorgcomp.dirsig import get_signatures
+from reorgcomp.dirsig import match_dirs
+from reorgcomp.dirsig import is_inside
+from reorgcomp.dirsig import get_common_suffix
+
+####
+
+
+def signatures(tree):
+	# tree: {dirpath: {filename: content}}, subdirectories deduced from the paths
+	entries = []
+	for dirpath in sorted(tree):
+		dirnames = sorted(os.path.basename(D) for D in tree
+			if D != dirpath and os.path.dirname(D) == dirpath)
+		entries.append((dirpath, dirnames, sorted(tree[dirpath])))
+	def get_hash(path):
+		return tree[os.path.dirname(path)][os.path.basename(path)]
+	return get_signatures(entries, get_hash)
+
+
+def test_signatures():
+
+	sigs = signatures({
+		"a": {},
+		"a/x": {"1.txt": "one", "2.txt": "two"},
+		"a/y": {"1.txt": "one", "2.txt": "two"},
+		"a/z": {"1.txt": "one", "2.txt": "changed"},
+		"a/y/empty": {},
+		})
+
+	assert sigs["a/x"][0] != sigs["a/y"][0]
+	assert sigs["a/x"][0] != sigs["a/z"][0]
+	assert sigs["a"][1] == 6
+	assert sigs["a/y/empty"][1] == 0
+
+	# Only the content counts, not the name of the directory itself
+	other = signatures({"b": {"1.txt": "one", "2.txt": "two"}})
+	assert other["b"][0] == sigs["a/x"][0]
+
+
+def test_match_dirs():
+
+	old = signatures({
+		"old": {},
+		"old/lib": {"a.c": "a"},
+		"old/lib/sub": {"b.c": "b"},
+		"old/doc": {"x.txt": "x"},
+		"old/copy": {"x.txt": "x"},
+		"old/gone": {"y.txt": "y"},
+		})
+	new = signatures({
+		"new": {},
+		"new/src": {},
+		"new/src/lib": {"a.c": "a"},
+		"new/src/lib/sub": {"b.c": "b"},
+		"new/copy": {"x.txt": "x"},
+		"new/y": {"y.txt": "changed"},
+		})
+
+	# The whole of lib moved, sub goes along with it; of the two identical
+	# directories the one keeping its name gets the match
+	assert match_dirs(old, new) == [
+		("old/lib", "new/src/lib"),
+		("old/copy", "new/copy"),
+		]
+
+
+def test_match_dirs_ambiguous():
+
+	old = signatures({
+		"old": {},
+		"old/z": {"main.py": "edited"},
+		"old/z/x": {"__init__.py": "x"},
+		"old/y": {"1.txt": "one"},
+		})
+	new = signatures({
+		"new": {},
+		"new/z": {"main.py": "main"},
+		"new/z/x": {"__init__.py": "x"},
+		"new/c": {},
+		"new/c/x": {"__init__.py": "x"},
+		"new/a": {"1.txt": "one"},
+		"new/b": {"1.txt": "one"},
+		})
+
+	# z/x didn't move even though c/x is identical, and nothing tells
+	# which of a and b y went to: its files are left to the file pass
+	assert match_dirs(old, new, "old", "new") == [("old/z/x", "new/z/x")]
+
+
+def test_common_suffix():
+	assert get_common_suffix("a/b/c", "x/b/c") == 2
+	assert get_common_suffix("a/b/c", "c") == 1
+	assert get_common_suffix("a/b", "a/c") == 0
+
+
+def test_is_inside():
+
+	dirs = set(["a/b"])
+	assert is_inside("a/b", dirs)
+	assert is_inside("a/b/c/d.txt", dirs)
+	assert not is_inside("a/bc", dirs)
+	assert not is_inside("a", dirs)
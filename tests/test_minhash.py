@@ -0,0 +1,47 @@
+# File: test_minhash.py
+
+####
+
+import random
+
+from reorgcomp.minhash import MinHashIndex
+from reorgcomp.minhash import get_shingles
+
+####
+
+
+def words(seed, count):
+	rng = random.Random(seed)
+	return ' '.join('w%d' % (rng.randint(0, 5000),) for _ in range(count))
+
+
+def test_shingles():
+	assert get_shingles("") == set()
+	assert len(get_shingles("a b")) == 1
+	assert get_shingles("a  b\n c d e") == get_shingles("a b c d e")
+
+
+def test_query():
+
+	original = words(1, 400)
+	edited = original.replace(original[1000:1100], "something else entirely")
+	unrelated = words(2, 400)
+
+	index = MinHashIndex()
+	index.add("original", original)
+	index.add("unrelated", unrelated)
+
+	assert index.query(edited) == ["original"], index.query(edited)
+	assert index.query(words(3, 400)) == []
+
+
+def test_add_signature():
+
+	original = words(1, 400)
+
+	index = MinHashIndex()
+	index.add_signature("original", MinHashIndex().signature(original))
+	index.add_signature("empty", MinHashIndex().signature(""))
+
+	assert index.query(original) == ["original"], index.query(original)
+	assert "empty" not in index.query("")
@@ -0,0 +1,90 @@
+# File: test_namecache.py
+
+####
+
+import os
+import time
+import shutil
+import tempfile
+
+from reorgcomp.namecache import NameCache
+
+####
+
+
+def test_get():
+
+	cache = NameCache()
+
+	assert cache.get("tests/data/B", "Greeting.txt") == ["tests/data/B/baz", "tests/data/B/baz/bar/foo"]
+	assert cache.get("tests/data/B", "Missing.txt") == []
+	assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evict():
+
+	cache = NameCache()
+	cache.get("tests/data/A", "Greeting.txt")
+	cache.get("tests/data/B", "Greeting.txt")
+
+	cache = NameCache(max_bytes=cache.size - 1)
+	cache.get("tests/data/A", "Greeting.txt")
+	cache.get("tests/data/B", "Greeting.txt")
+
+	assert cache.trees.keys() == ["tests/data/B"]
+	assert cache.evictions == 1
+
+
+def test_over_budget():
+
+	walks = []
+	def walk(scandir):
+		walks.append(scandir)
+		return os.walk(scandir)
+
+	cache = NameCache(walk, max_bytes=0)
+	for _ in range(5):
+		cache.get("tests/data/B", "Greeting.txt")
+	assert walks == ["tests/data/B"], walks
+
+	cache.get("tests/data/A", "Greeting.txt")
+	assert cache.trees.keys() == ["tests/data/A"]
+	assert cache.evictions == 1
+
+
+def test_slow_check():
+
+	cache = NameCache(check_interval=0.05)
+	cache.get("tests/data/B", "Greeting.txt")
+	tree = cache.trees["tests/data/B"]
+
+	checks = []
+	def is_stale(tree):
+		checks.append(tree)
+		time.sleep(0.1)
+		return False
+	cache._is_stale = is_stale
+
+	# The check took longer than the interval, the next lookup mustn't
+	# check again right away
+	tree.checked -= 1
+	cache.get("tests/data/B", "Greeting.txt")
+	cache.get("tests/data/B", "Greeting.txt")
+	assert len(checks) == 1, checks
+
+
+def test_invalidate_on_change():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		cache = NameCache(check_interval=0)
+		assert cache.get(tmpdir, "new.txt") == []
+
+		open(os.path.join(tmpdir, "new.txt"), 'w').close()
+		os.utime(tmpdir, (0, 0))
+
+		assert cache.get(tmpdir, "new.txt") == [tmpdir]
+		assert cache.invalidations == 1
+
+	finally:
+		shutil.rmtree(tmpdir)
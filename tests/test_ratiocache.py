@@ -0,0 +1,47 @@
+# File: test_ratiocache.py
+
+####
+
+import os
+import shutil
+import tempfile
+
+from reorgcomp.ratiocache import RatioCache
+
+####
+
+
+def test_exact_and_bounds():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		filename = os.path.join(tmpdir, "ratios.sqlite")
+
+		cache = RatioCache(filename)
+		assert cache.get("a", "b", "chars") == (False, None)
+
+		cache.put("a", "b", "chars", None, 0.75)
+		assert cache.get("a", "b", "chars") == (True, 0.75)
+		assert cache.get("a", "b", "chars", cutoff=0.8) == (True, None)
+		assert cache.get("b", "a", "chars") == (False, None)
+		assert cache.get("a", "b", "lines") == (False, None)
+
+		# Cut off at 0.6: only known to be below that
+		cache.put("a", "c", "chars", 0.6, None)
+		assert cache.get("a", "c", "chars", cutoff=0.6) == (True, None)
+		assert cache.get("a", "c", "chars", cutoff=0.9) == (True, None)
+		assert cache.get("a", "c", "chars", cutoff=0.5) == (False, None)
+		assert cache.get("a", "c", "chars") == (False, None)
+
+		cache.put("a", "c", "chars", 0.5, 0.55)
+		assert cache.get("a", "c", "chars") == (True, 0.55)
+		cache.close()
+
+		reopened = RatioCache(filename)
+		assert reopened.get("a", "b", "chars") == (True, 0.75)
+		assert reopened.get("a", "c", "chars") == (True, 0.55)
+		assert (reopened.hits, reopened.misses) == (2, 0)
+		reopened.close()
+
+	finally:
+		shutil.rmtree(tmpdir)
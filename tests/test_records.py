@@ -0,0 +1,67 @@
+# File: test_records.py
+
+####
+
+from os import path
+
+import tempfile
+
+from nose.tools import with_setup
+
+from utils import delete_later
+
+from reorgcomp.records import get_format
+from reorgcomp.records import write_records
+from reorgcomp.records import iter_records
+from reorgcomp.records import FORMAT_REPR, FORMAT_JSONL, FORMAT_MARSHAL
+
+####
+
+def T(filename):
+	return path.join(tempfile.gettempdir(), filename)
+
+
+testdata = [
+	('tests/data/A/foo/bar/baz/Greeting.txt',
+		[('tests/data/B/baz/bar/foo/Greeting.txt', 1.0),
+		 ('tests/data/B/baz/Greeting.txt', 0.36363636363636365)]),
+	('tests/data/A/Missing.txt', []),
+	('tests/data/A/Picked.txt', 'tests/data/B/Picked.txt', 0.5),
+	('tests/data/A/Deleted.txt', None, -1),
+	('tests/data/B/Dupe.txt', [('tests/data/A/Dupe.txt',)]),
+	('tests/data/A/\xff\xfe.txt', [('tests/data/B/\xe9t\xe9.txt', 1.0)]),
+]
+
+
+def test_get_format():
+	assert get_format("moves.txt") == FORMAT_REPR
+	assert get_format("moves.jsonl") == FORMAT_JSONL
+	assert get_format("moves.marshal") == FORMAT_MARSHAL
+
+
+test_jsonl_file = T("test_records.jsonl")
+
+@with_setup(teardown=delete_later(test_jsonl_file))
+def test_roundtrip_jsonl():
+	write_records(test_jsonl_file, iter(testdata))
+	loaded = list(iter_records(test_jsonl_file))
+	assert loaded == testdata, loaded
+	assert len(open(test_jsonl_file).readlines()) == len(testdata)
+
+
+test_marshal_file = T("test_records.marshal")
+
+@with_setup(teardown=delete_later(test_marshal_file))
+def test_roundtrip_marshal():
+	write_records(test_marshal_file, iter(testdata))
+	loaded = list(iter_records(test_marshal_file))
+	assert loaded == testdata, loaded
+
+
+test_repr_file = T("test_records.txt")
+
+@with_setup(teardown=delete_later(test_repr_file))
+def test_roundtrip_repr():
+	write_records(test_repr_file, iter(testdata))
+	loaded = list(iter_records(test_repr_file))
+	assert loaded == testdata, loaded
@@ -0,0 +1,76 @@
+# File: test_replace.py
+
+####
+
+import random
+
+from reorgcomp.replace import overlap
+from reorgcomp.replace import is_single_pass_safe
+from reorgcomp.replace import MultiReplacer
+
+####
+
+
+def sequential(renames, s):
+	for (from_, to_) in renames:
+		s = s.replace(from_, to_)
+	return s
+
+
+def test_overlap():
+	assert overlap("abc", "bcd")
+	assert overlap("bc", "abcd")
+	assert overlap("", "abc")
+	assert not overlap("abc", "xyz")
+	assert not overlap("Old", "old")
+
+
+def test_single_pass_safe():
+	assert is_single_pass_safe([("OLD", "NEW"), ("Old", "New"), ("old", "new")])
+	assert not is_single_pass_safe([("a", "b"), ("b", "c")])
+	assert is_single_pass_safe([("b", "c"), ("a", "b")])
+	assert not is_single_pass_safe([("ab", "x"), ("bc", "y")])
+	assert not is_single_pass_safe([("x", ""), ("ab", "y")])
+
+
+def test_matches_sequential():
+
+	rng = random.Random(1)
+	alphabet = "abc"
+
+	def word(low, high):
+		return ''.join(rng.choice(alphabet) for _ in range(rng.randint(low, high)))
+
+	for _ in range(2000):
+		renames = [(word(1, 3), word(0, 3)) for _ in range(rng.randint(1, 4))]
+		s = word(0, 20)
+
+		replacer = MultiReplacer(renames)
+
+		assert replacer.replace(s) == sequential(renames, s), (renames, s)
+		assert replacer.search(s) == any(from_ in s for (from_, _) in renames)
+
+
+def test_replace_file_chunked():
+
+	from StringIO import StringIO
+
+	rng = random.Random(2)
+	alphabet = "abc"
+
+	def word(low, high):
+		return ''.join(rng.choice(alphabet) for _ in range(rng.randint(low, high)))
+
+	for _ in range(500):
+		renames = [(word(1, 4), word(0, 3)) for _ in range(rng.randint(1, 3))]
+		s = word(0, 40)
+
+		replacer = MultiReplacer(renames)
+
+		for chunk_size in (1, 2, 3, 7):
+			outfp = StringIO()
+			replacer.replace_file(StringIO(s), outfp, chunk_size)
+			assert outfp.getvalue() == sequential(renames, s), (renames, s, chunk_size)
+
+			found = replacer.search_file(StringIO(s), chunk_size)
+			assert found == any(from_ in s for (from_, _) in renames), (renames, s, chunk_size)
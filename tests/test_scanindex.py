@@ -0,0 +1,54 @@
+# File: test_scanindex.py
+
+####
+
+import os
+import shutil
+import tempfile
+
+from reorgcomp.scanindex import ScanIndex
+from reorgcomp.scanindex import FIELD_HASH
+
+####
+
+
+def test_walk_matches_os_walk():
+
+	indexdir = tempfile.mkdtemp()
+	try:
+		index = ScanIndex("tests/data", os.path.join(indexdir, "data.idx"))
+		index.refresh()
+
+		expected = list(os.walk("tests/data"))
+		actual = list(index.walk())
+
+		assert expected == actual, (expected, actual)
+
+	finally:
+		shutil.rmtree(indexdir)
+
+
+def test_refresh_reuses_unchanged():
+
+	indexdir = tempfile.mkdtemp()
+	try:
+		filename = os.path.join(indexdir, "data.idx")
+
+		index = ScanIndex("tests/data", filename)
+		index.refresh()
+		index.set("tests/data/A/foo/bar/baz/Greeting.txt", FIELD_HASH, "hash")
+		index.save()
+
+		assert index.rescanned == 3, index.rescanned
+
+		index = ScanIndex("tests/data", filename)
+		assert index.load()
+		index.refresh()
+
+		assert index.rescanned == 0, index.rescanned
+		assert index.reused == 3, index.reused
+		assert index.get("tests/data/A/foo/bar/baz/Greeting.txt", FIELD_HASH) == "hash"
+		assert not index.dirty
+
+	finally:
+		shutil.rmtree(indexdir)
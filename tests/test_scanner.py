@@ -0,0 +1,91 @@
+# File: test_scanner.py
+
+####
+
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+import reorgcomp.scanner
+
+from reorgcomp.scanner import Scanner
+
+####
+
+
+def make_tree(base):
+	for dirpath in ("a", "a/b", "a/b/c", "d", "e/f"):
+		os.makedirs(os.path.join(base, dirpath))
+	for filepath in ("x.txt", "a/y.txt", "a/b/c/z.txt", "d/w.txt"):
+		with open(os.path.join(base, filepath), 'w') as fp:
+			fp.write(filepath)
+	os.symlink(os.path.join(base, "a"), os.path.join(base, "link"))
+
+
+def test_walk():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		make_tree(tmpdir)
+		scanner = Scanner(4)
+
+		assert list(scanner.walk(tmpdir)) == list(os.walk(tmpdir))
+
+		# The listing of a pruned directory is never used
+		def pruned(walk):
+			for (dirpath, dirnames, filenames) in walk:
+				if "b" in dirnames:
+					dirnames.remove("b")
+				yield (dirpath, dirnames, filenames)
+
+		assert list(pruned(scanner.walk(tmpdir))) == list(pruned(os.walk(tmpdir)))
+
+		assert list(scanner.walk(os.path.join(tmpdir, "missing"))) == []
+
+		scanner.close()
+	finally:
+		shutil.rmtree(tmpdir)
+
+
+def test_walk_listdir_fallback():
+
+	tmpdir = tempfile.mkdtemp()
+	saved = reorgcomp.scanner.scandir
+	try:
+		make_tree(tmpdir)
+		reorgcomp.scanner.scandir = None
+		assert list(Scanner(2).walk(tmpdir)) == list(os.walk(tmpdir))
+	finally:
+		reorgcomp.scanner.scandir = saved
+		shutil.rmtree(tmpdir)
+
+
+def test_map():
+
+	scanner = Scanner(3)
+	assert scanner.map(lambda x: x * x, range(100)) == [x * x for x in range(100)]
+	assert scanner.map(len, []) == []
+
+
+_shared = Scanner(2)
+
+def _count_in_child(base):
+	return sum(len(filenames) for (_, _, filenames) in _shared.walk(base))
+
+
+def test_after_fork():
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		make_tree(tmpdir)
+		# Used before forking: the workers must start their own threads
+		assert _count_in_child(tmpdir) == 4
+		pool = multiprocessing.Pool(2)
+		try:
+			assert pool.map(_count_in_child, [tmpdir] * 2) == [4, 4]
+		finally:
+			pool.terminate()
+			pool.join()
+	finally:
+		shutil.rmtree(tmpdir)
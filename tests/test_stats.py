@@ -0,0 +1,47 @@
+# File: test_stats.py
+
+####
+
+from reorgcomp.stats import Stats
+
+####
+
+
+def test_wrap():
+
+	stats = Stats()
+
+	double = stats.wrap("double", lambda x: x * 2, measure=len, unit="chars")
+	assert double("ab") == "abab"
+	assert double("c") == "cc"
+
+	(calls, seconds, amount, unit) = stats.counters["double"]
+	assert (calls, amount, unit) == (2, 6, "chars")
+	assert seconds >= 0.0
+
+	def failing():
+		raise ValueError()
+
+	failing = stats.wrap("failing", failing)
+	try:
+		failing()
+	except ValueError:
+		pass
+	assert stats.counters["failing"][0] == 1
+
+	assert [line.split()[1] for line in stats.report().splitlines()] == ["double", "failing"]
+
+
+def test_wrap_iter():
+
+	stats = Stats()
+
+	def entries():
+		yield ("a", [], ["x", "y"])
+		yield ("b", [], ["z"])
+
+	walk = stats.wrap_iter("walk", entries, measure=lambda entry: len(entry[2]), unit="files")
+	assert list(walk()) == list(entries())
+
+	(calls, seconds, amount, unit) = stats.counters["walk"]
+	assert (calls, amount) == (1, 3)